@@ -17,10 +17,19 @@
 # specific language governing permissions and limitations
 # under the License.
 #
-"""Tool to gauge message passing throughput and latencies"""
+"""Tool to gauge message passing throughput and latencies.
+
+By default a single message is outstanding at a time (closed-loop).  With
+--rate the tool runs open-loop: messages are sent on a fixed schedule over
+many links and connections whether or not earlier messages have been
+acknowledged, and latency is measured from the time each message was
+scheduled to be sent.  This avoids the coordinated omission of closed-loop
+testing, where a slow server also slows down the load.
+"""
 
 import logging
 import optparse
+import select
 import time
 import uuid
 
@@ -128,6 +137,260 @@ class ReceiverHandler(pyngus.ReceiverEventHandler):
             receiver.add_capacity(cap - lc)
 
 
+class RateSchedule(object):
+    """Generates the intended send times of an open-loop test.
+
+    constant: send at rate for duration seconds.
+    step: send at each of steps rates from rate to rate_end, each for
+    duration seconds.
+    ramp: increase the rate linearly from rate to rate_end over steps *
+    duration seconds.
+
+    Results are reported for each interval of duration seconds.
+    """
+    def __init__(self, profile, rate, rate_end, steps, duration, start):
+        if profile not in ("constant", "step", "ramp"):
+            raise Exception("Invalid load profile: %s" % profile)
+        if profile == "constant":
+            steps = 1
+        self.profile = profile
+        self.rate = float(rate)
+        self.rate_end = float(rate_end if rate_end else rate)
+        self.steps = steps
+        self.duration = float(duration)
+        self.start = start
+        self.end = start + steps * self.duration
+        self._next = start
+
+    def rate_at(self, when):
+        """The target send rate at the given time."""
+        elapsed = when - self.start
+        if self.profile == "constant" or self.steps == 1:
+            return self.rate
+        if self.profile == "step":
+            step = min(int(elapsed / self.duration), self.steps - 1)
+            return (self.rate +
+                    (self.rate_end - self.rate) * step / (self.steps - 1))
+        return (self.rate +
+                (self.rate_end - self.rate) * elapsed / (self.end -
+                                                         self.start))
+
+    def interval(self, when):
+        """The index of the reporting interval containing when."""
+        return min(int((when - self.start) / self.duration), self.steps - 1)
+
+    def next(self):
+        """Return the intended time of the next send, or None when the
+        schedule is complete.
+        """
+        when = self._next
+        if when >= self.end:
+            return None
+        self._next = when + 1.0 / self.rate_at(when)
+        return when
+
+
+class IntervalStats(object):
+    def __init__(self):
+        self.scheduled = 0
+        self.acked = 0
+        self.ack_latency = pyngus.LatencyHistogram()
+        self.rx_latency = pyngus.LatencyHistogram()
+
+
+class OpenLoopResults(object):
+    """The statistics of each reporting interval of the schedule."""
+    def __init__(self):
+        self.schedule = None
+        self.intervals = []
+
+    def start(self, schedule):
+        self.schedule = schedule
+        self.intervals = [IntervalStats() for i in range(schedule.steps)]
+
+    def __getitem__(self, intended):
+        """The stats of the interval containing the intended send time."""
+        return self.intervals[self.schedule.interval(intended)]
+
+
+class OpenLoopSender(pyngus.SenderEventHandler):
+    """Records the latency of each send from its intended send time.  The
+    intended time is passed as the send handle.
+    """
+    def __init__(self, results):
+        self._results = results
+        self.pending = 0
+
+    def __call__(self, link, intended, status, error):
+        self.pending -= 1
+        stats = self._results[intended]
+        stats.acked += 1
+        stats.ack_latency.record(time.time() - intended)
+
+    def sender_failed(self, sender_link, error):
+        LOG.warn("Sender failed error=%s", error)
+        sender_link.close()
+
+
+class OpenLoopReceiver(pyngus.ReceiverEventHandler):
+    def __init__(self, results, capacity):
+        self._results = results
+        self._capacity = capacity
+
+    def receiver_active(self, receiver_link):
+        receiver_link.add_capacity(self._capacity)
+
+    def receiver_failed(self, receiver_link, error):
+        LOG.warn("receiver_failed error=%s", error)
+        receiver_link.close()
+
+    def message_received(self, receiver, message, handle):
+        now = time.time()
+        receiver.message_accepted(handle)
+        body = message.body
+        # ignore messages not sent by this run:
+        if (self._results.schedule and isinstance(body, dict) and
+                body.get('intended', 0) >= self._results.schedule.start):
+            intended = body['intended']
+            self._results[intended].rx_latency.record(now - intended)
+        if receiver.capacity < self._capacity / 2:
+            receiver.add_capacity(self._capacity - receiver.capacity)
+
+
+def process_connections(connections, deadline):
+    """Handle I/O and timers on many (connection, socket) pairs, waiting
+    no later than deadline.
+    """
+    readfd = []
+    writefd = []
+    sockets = {}
+    for connection, my_socket in connections:
+        sockets[my_socket] = connection
+        if connection.needs_input > 0:
+            readfd.append(my_socket)
+        if connection.has_output > 0:
+            writefd.append(my_socket)
+        if connection.deadline:
+            deadline = min(deadline, connection.deadline)
+    timeout = max(0.0, deadline - time.time())
+    readable, writable, ignore = select.select(readfd, writefd, [], timeout)
+    for my_socket in readable:
+        try:
+            pyngus.read_socket_input(sockets[my_socket], my_socket)
+        except Exception as e:
+            LOG.error("Socket error on read: %s", str(e))
+            sockets[my_socket].close_input()
+            sockets[my_socket].close()
+    now = time.time()
+    for connection, my_socket in connections:
+        connection.process(now)
+    for my_socket in writable:
+        try:
+            pyngus.write_socket_output(sockets[my_socket], my_socket)
+        except Exception as e:
+            LOG.error("Socket error on write %s", str(e))
+            sockets[my_socket].close_output()
+            sockets[my_socket].close()
+
+
+def run_open_loop(opts, host, port, container, conn_properties):
+    connections = []
+    senders = []
+    links = []
+    handlers = []
+    results = OpenLoopResults()
+    for i in range(opts.connections):
+        c_handler = ConnectionEventHandler()
+        connection = container.create_connection("perf_tool-%d" % i,
+                                                 c_handler,
+                                                 conn_properties)
+        connection.open()
+        connections.append((connection, connect_socket(host, port)))
+
+    for connection, my_socket in connections:
+        r_handler = OpenLoopReceiver(results, opts.capacity)
+        receiver = connection.create_receiver(opts.node, opts.node,
+                                              r_handler)
+        receiver.open()
+        links.append(receiver)
+        for i in range(opts.links):
+            s_handler = OpenLoopSender(results)
+            sender = connection.create_sender(opts.node, opts.node,
+                                              s_handler,
+                                              name="sender-%d" % i)
+            sender.open()
+            links.append(sender)
+            senders.append((sender, s_handler))
+            handlers.append(s_handler)
+    while not all(link.active for link in links):
+        process_connections(connections, time.time() + 1.0)
+
+    # the schedule starts once all links are up:
+    start = time.time()
+    schedule = RateSchedule(opts.profile, opts.rate, opts.rate_end,
+                            opts.steps, opts.duration, start)
+    results.start(schedule)
+
+    index = 0
+    intended = schedule.next()
+    while intended is not None:
+        now = time.time()
+        # send everything that is due, even if the server is slow: the
+        # latency of late sends includes the time they were due
+        while intended is not None and intended <= now:
+            sender, s_handler = senders[index % len(senders)]
+            index += 1
+            # a new Message per send: messages waiting for credit are
+            # only encoded when they are written
+            msg = Message(body={'intended': intended})
+            sender.send(msg, s_handler, handle=intended)
+            s_handler.pending += 1
+            results[intended].scheduled += 1
+            intended = schedule.next()
+        process_connections(connections,
+                            intended if intended is not None else now)
+
+    # wait for the outstanding sends to complete:
+    drain = time.time() + opts.drain
+    while (any(h.pending for h in handlers) and time.time() < drain):
+        process_connections(connections, time.time() + 0.1)
+
+    print("%8s %10s %10s %10s %10s %10s %10s %10s"
+          % ("interval", "target/s", "sent/s", "acked/s", "ack-p50",
+             "ack-p99", "ack-p999", "rx-p99"))
+    for i, st in enumerate(results.intervals):
+        when = start + (i + 0.5) * schedule.duration
+        ack = st.ack_latency
+        rx = st.rx_latency
+
+        def ms(histogram, percent):
+            value = histogram.percentile(percent)
+            return "%.3f" % (value * 1000.0) if value is not None else "-"
+        print("%8d %10.1f %10.1f %10.1f %10s %10s %10s %10s"
+              % (i, schedule.rate_at(when),
+                 st.scheduled / schedule.duration,
+                 st.acked / schedule.duration,
+                 ms(ack, 50), ms(ack, 99), ms(ack, 99.9), ms(rx, 99)))
+    lost = sum(h.pending for h in handlers)
+    if lost:
+        print("%d sends not acknowledged after %.1f seconds"
+              % (lost, opts.drain))
+    print("Latencies in milliseconds, measured from the intended send time")
+
+    for link in links:
+        link.close()
+    for connection, my_socket in connections:
+        connection.close()
+    while not all(c.closed for c, s in connections):
+        process_connections(connections, time.time() + 1.0)
+    for link in links:
+        link.destroy()
+    for connection, my_socket in connections:
+        connection.destroy()
+        my_socket.close()
+    return 0
+
+
 def main(argv=None):
 
     _usage = """Usage: %prog [options]"""
@@ -143,12 +406,31 @@ def main(argv=None):
                       help="enable debug logging")
     parser.add_option("--trace", dest="trace", action="store_true",
                       help="enable protocol tracing")
+    parser.add_option("--rate", type='float',
+                      help="Open-loop mode: send N messages/second")
+    parser.add_option("--profile", default="constant",
+                      help="Open-loop load profile: constant, step or ramp"
+                      " [constant]")
+    parser.add_option("--rate-end", type='float',
+                      help="Final rate of a step or ramp profile")
+    parser.add_option("--steps", type='int', default=5,
+                      help="Number of step or ramp intervals [5]")
+    parser.add_option("--duration", type='float', default=10.0,
+                      help="Open-loop seconds per interval [10]")
+    parser.add_option("--connections", type='int', default=1,
+                      help="Open-loop number of connections [1]")
+    parser.add_option("--links", type='int', default=1,
+                      help="Open-loop sending links per connection [1]")
+    parser.add_option("--capacity", type='int', default=1000,
+                      help="Open-loop receive credit per connection [1000]")
+    parser.add_option("--drain", type='float', default=10.0,
+                      help="Open-loop seconds to wait for outstanding"
+                      " acknowledgements [10]")
 
     opts, _ = parser.parse_args(args=argv)
     if opts.debug:
         LOG.setLevel(logging.DEBUG)
     host, port = get_host_port(opts.server)
-    my_socket = connect_socket(host, port)
 
     # create AMQP Container, Connection, and SenderLink
     #
@@ -158,6 +440,13 @@ def main(argv=None):
     if opts.trace:
         conn_properties["x-trace-protocol"] = True
 
+    if opts.rate:
+        rc = run_open_loop(opts, host, port, container, conn_properties)
+        container.destroy()
+        return rc
+
+    my_socket = connect_socket(host, port)
+
     c_handler = ConnectionEventHandler()
     connection = container.create_connection("perf_tool",
                                              c_handler,
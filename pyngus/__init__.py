@@ -16,10 +16,14 @@
 # specific language governing permissions and limitations
 # under the License.
 #
+from pyngus.capture import read_capture, replay_capture
 from pyngus.container import Container
-from pyngus.connection import Connection, ConnectionEventHandler
+from pyngus.connection import Connection, ConnectionConfig
+from pyngus.connection import ConnectionEventHandler, clear_ssl_domains
+from pyngus.histogram import LatencyHistogram
 from pyngus.link import ReceiverLink, ReceiverEventHandler
 from pyngus.link import SenderLink, SenderEventHandler
+from pyngus.monitor import CallbackProfiler, LoopMonitor
 from pyngus.sockets import read_socket_input
 from pyngus.sockets import write_socket_output
 
@@ -0,0 +1,153 @@
+#    Licensed to the Apache Software Foundation (ASF) under one
+#    or more contributor license agreements.  See the NOTICE file
+#    distributed with this work for additional information
+#    regarding copyright ownership.  The ASF licenses this file
+#    to you under the Apache License, Version 2.0 (the
+#    "License"); you may not use this file except in compliance
+#    with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an
+#    "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#    KIND, either express or implied.  See the License for the
+#    specific language governing permissions and limitations
+#    under the License.
+"""Record the network traffic of a Connection, and replay it.
+
+A capture file starts with a one line header followed by a line of JSON
+describing the connection.  The rest of the file is a sequence of
+records, each a 13 byte record header (direction, timestamp, length) and
+the data.  A zero length record marks the end of that direction's stream.
+"""
+__all__ = [
+    "INPUT",
+    "OUTPUT",
+    "read_capture",
+    "replay_capture"
+]
+
+import json
+import logging
+import struct
+import time
+
+LOG = logging.getLogger(__name__)
+
+INPUT = 0   # data passed to Connection.process_input()
+OUTPUT = 1  # data written from Connection.output_data()
+
+_MAGIC = b"PYNGUS-CAPTURE 1\n"
+_RECORD = struct.Struct("!BdI")
+
+
+class _CaptureFile(object):
+    """Writes the traffic of a Connection to a capture file.  See the
+    x-capture-file property.
+    """
+    __slots__ = ("_file", "_owned")
+
+    def __init__(self, capture, info):
+        if hasattr(capture, "write"):
+            self._file = capture
+            self._owned = False
+        else:
+            self._file = open(capture, "wb")
+            self._owned = True
+        self._file.write(_MAGIC)
+        self._file.write(json.dumps(info).encode("utf-8") + b"\n")
+
+    def record(self, direction, data):
+        self._file.write(_RECORD.pack(direction, time.time(), len(data)))
+        if data:
+            self._file.write(data)
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+
+
+def _open(capture):
+    if hasattr(capture, "read"):
+        return capture, False
+    return open(capture, "rb"), True
+
+
+def read_capture(capture):
+    """Read a capture file.  capture is either a path or a binary file
+    object.  Returns a tuple of the map describing the captured connection
+    and a generator of (direction, timestamp, data) records.
+    """
+    f, owned = _open(capture)
+    if f.readline() != _MAGIC:
+        if owned:
+            f.close()
+        raise Exception("Invalid capture file: %s" % capture)
+    info = json.loads(f.readline().decode("utf-8"))
+
+    def _records():
+        try:
+            while True:
+                header = f.read(_RECORD.size)
+                if len(header) < _RECORD.size:
+                    return  # truncated capture, e.g. process exited
+                direction, timestamp, length = _RECORD.unpack(header)
+                data = f.read(length) if length else b""
+                if len(data) < length:
+                    return
+                yield direction, timestamp, data
+        finally:
+            if owned:
+                f.close()
+    return info, _records()
+
+
+def replay_capture(capture, connection):
+    """Feed the input recorded in a capture file to a Connection, as fast
+    as possible.  The Connection is processed using the timestamps of the
+    capture, and its output is discarded.  Returns the number of input
+    bytes consumed.
+
+    Only the received traffic is replayed: links created by the
+    application during the capture must also be created by the application
+    during the replay.  The traffic of SSL/TLS connections is encrypted and
+    cannot be replayed.
+    """
+    info, records = read_capture(capture)
+    total = 0
+    for direction, timestamp, data in records:
+        if direction != INPUT:
+            continue
+        if not data:
+            connection.close_input()
+            connection.process(timestamp)
+            break
+        while data:
+            count = connection.process_input(data)
+            if count < 0:  # EOS
+                return total
+            if count == 0:
+                # input stalled, e.g. waiting for the application to
+                # grant credit or accept a link:
+                connection.process(timestamp)
+                _discard_output(connection)
+                count = connection.process_input(data)
+                if count <= 0:
+                    LOG.warning("Replay of %s stalled", info.get("name"))
+                    return total
+            total += count
+            data = data[count:]
+            connection.process(timestamp)
+            _discard_output(connection)
+    return total
+
+
+def _discard_output(connection):
+    count = connection.has_output
+    while count > 0:
+        connection.output_written(count)
+        count = connection.has_output
@@ -20,40 +20,141 @@ __all__ = [
     "Connection"
 ]
 
+import collections
+import hashlib
 import heapq
 import logging
 import proton
 import warnings
 import ssl
+import time
 
+from pyngus.capture import _CaptureFile
+from pyngus.capture import INPUT as _CAPTURE_INPUT
+from pyngus.capture import OUTPUT as _CAPTURE_OUTPUT
 from pyngus.endpoint import Endpoint
+from pyngus.endpoint import _CHECK_REENTRANCY
 from pyngus.link import _Link
 from pyngus.link import _SessionProxy
 
+try:
+    # installs a tracer that is not passed a new Transport wrapper per frame
+    from cproton import pn_transport_set_pytracer as _set_pytracer
+except ImportError:
+    _set_pytracer = None
+
+try:
+    # inspect events without creating a proton.Event wrapper for each.  This
+    # relies on proton.Collector keeping its pn_collector_t in _impl, as of
+    # python-qpid-proton 0.40.0 (see test_skip_events in the unit tests)
+    from cproton import pn_collector_peek as _pn_collector_peek
+    from cproton import pn_collector_pop as _pn_collector_pop
+    from cproton import pn_event_type as _pn_event_type
+except ImportError:
+    _pn_collector_peek = None
+
 LOG = logging.getLogger(__name__)
 
 _PROTON_VERSION = (int(getattr(proton, "VERSION_MAJOR", 0)),
                    int(getattr(proton, "VERSION_MINOR", 0)))
 
 
-class _CallbackLock(object):
-    """A utility class for detecting when a callback invokes a non-reentrant
-    Pyngus method.
+class _WindowTuner(object):
+    """Periodically adjusts the incoming capacity of a Connection's sessions.
+    See the x-session-autotune property.
+    """
+    __slots__ = ("interval", "min_capacity", "max_capacity", "memory_limit",
+                 "deadline")
+
+    def __init__(self, config, capacity):
+        if not isinstance(config, dict):
+            config = {}
+        self.interval = config.get("interval", 1.0)
+        self.min_capacity = config.get("min-capacity", capacity)
+        self.max_capacity = config.get("max-capacity", 64 * capacity)
+        self.memory_limit = config.get("memory-limit")
+        self.deadline = 0
+
+    def tune(self, pn_connection, now):
+        """Sample the data buffered by each active session.  Called before
+        the pending events are processed, so the buffered data is the amount
+        that arrived since the last call to Connection.process().
+        """
+        self.deadline = now + self.interval
+        mask = proton.Endpoint.LOCAL_ACTIVE
+        sessions = []
+        total = 0
+        pn_session = pn_connection.session_head(mask)
+        while pn_session:
+            buffered = pn_session.incoming_bytes
+            total += buffered
+            sessions.append((pn_session, buffered))
+            pn_session = pn_session.next(mask)
+
+        if self.memory_limit is not None and total > self.memory_limit:
+            # memory pressure: shrink all windows
+            for pn_session, buffered in sessions:
+                capacity = pn_session.incoming_capacity
+                if capacity > self.min_capacity:
+                    pn_session.incoming_capacity = max(self.min_capacity,
+                                                       capacity // 2)
+            return
+
+        for pn_session, buffered in sessions:
+            # the peer has filled at least half the window since the last
+            # pass: the window is limiting throughput
+            capacity = pn_session.incoming_capacity
+            if 0 < capacity < self.max_capacity and 2 * buffered >= capacity:
+                pn_session.incoming_capacity = min(self.max_capacity,
+                                                   2 * capacity)
+
+
+class _TraceBuffer(object):
+    """Keeps the most recent protocol frames traced by a transport.  Only
+    one in every sample frames is kept.  See the x-trace-buffer property.
     """
-    def __init__(self):
-        super(_CallbackLock, self).__init__()
-        self.in_callback = 0
+    __slots__ = ("frames", "sample", "_skip")
 
-    def __enter__(self):
-        self.in_callback += 1
+    def __init__(self, size, sample):
+        self.frames = collections.deque(maxlen=size)
+        self.sample = sample
+        self._skip = 0
+
+    def __call__(self, pn_transport, message):
+        if self._skip:
+            self._skip -= 1
+            return
+        self._skip = self.sample - 1
+        self.frames.append((time.time(), message))
+
+    @property
+    def tracer(self):
+        # for proton's Transport.tracer property when set by _set_pytracer
         return self
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.in_callback -= 1
-        # if a call is made to a non-reentrant method while this context is
-        # held, then the method will raise a RuntimeError().  Return false to
-        # propagate the exception to the caller
-        return False
+
+if _pn_collector_peek:
+    def _skip_events(pn_collector):
+        """Pop the events at the head of the collector that Connection has
+        no handler for, without wrapping them.  Returns the number of events
+        popped.
+        """
+        impl = getattr(pn_collector, "_impl", None)
+        if impl is None:
+            # not a proton.Collector, e.g. tests/dispatch-perf-test.py.  All
+            # events are then wrapped and counted against the budget
+            return 0
+        handled = Connection._EVENT_NUMBERS
+        count = 0
+        pn_event = _pn_collector_peek(impl)
+        while pn_event and _pn_event_type(pn_event) not in handled:
+            _pn_collector_pop(impl)
+            count += 1
+            pn_event = _pn_collector_peek(impl)
+        return count
+else:
+    def _skip_events(pn_collector):
+        return 0
 
 
 class ConnectionEventHandler(object):
@@ -100,9 +201,74 @@ class ConnectionEventHandler(object):
         LOG.debug("sasl_done (ignored)")
 
 
-class Connection(Endpoint):
-    """A Connection to a peer."""
-    EOS = -1   # indicates 'I/O stream closed'
+# proton.SSLDomains shared by all Connections, indexed by (mode, identity,
+# CA file, verify mode, allow cleartext), least recently used first.  The
+# identity is (certificate, key file, SHA-256 of the key password):
+_SSL_DOMAINS = collections.OrderedDict()
+_SSL_DOMAINS_MAX = 16
+
+
+def _ssl_domain_key(mode, identity, ca_file, vmode, cleartext):
+    if identity:
+        password = identity[2]
+        if password is not None:
+            if not isinstance(password, bytes):
+                password = password.encode("utf-8")
+            password = hashlib.sha256(password).hexdigest()
+        identity = (identity[0], identity[1], password)
+    return (mode, identity, ca_file, vmode, cleartext)
+
+
+def _get_ssl_domain(key, identity):
+    domain = _SSL_DOMAINS.pop(key, None)
+    if domain is None:
+        mode, _, ca_file, vmode, cleartext = key
+        # This will throw proton.SSLUnavailable if SSL support is not
+        # installed
+        domain = proton.SSLDomain(mode)
+        if identity:
+            # our identity:
+            domain.set_credentials(identity[0], identity[1], identity[2])
+        if ca_file:
+            # how we verify peers:
+            domain.set_trusted_ca_db(ca_file)
+        domain.set_peer_authentication(vmode, ca_file)
+        if cleartext:
+            domain.allow_unsecured_client()
+        while len(_SSL_DOMAINS) >= _SSL_DOMAINS_MAX:
+            # Connections using an evicted domain keep a reference to it
+            _SSL_DOMAINS.popitem(last=False)
+    _SSL_DOMAINS[key] = domain  # most recently used
+    return domain
+
+
+def clear_ssl_domains(path=None):
+    """Discard the cached SSL domains, so that the certificate, key and CA
+    files are read again by the next Connection.  If path is given only the
+    domains that use that file are discarded.  Connections that already
+    exist are not affected.  Returns the number of domains discarded.
+    """
+    if path is None:
+        count = len(_SSL_DOMAINS)
+        _SSL_DOMAINS.clear()
+        return count
+    stale = [key for key in _SSL_DOMAINS
+             if key[2] == path or (key[1] and path in key[1][:2])]
+    for key in stale:
+        del _SSL_DOMAINS[key]
+    return len(stale)
+
+
+class ConnectionConfig(object):
+    """Connection properties that are validated and compiled once.  A
+    ConnectionConfig may be passed to Container.create_connection() in place
+    of the properties map, to create any number of Connections with the
+    same properties.  See Connection for the supported properties.
+    """
+    __slots__ = ("_properties", "_server", "_trace_size", "_trace_sample",
+                 "_sasl", "_sasl_mechs", "_sasl_insecure",
+                 "_ssl_key", "_ssl_identity", "_ssl_peer_name",
+                 "_ssl_session_id")
 
     # set of all SASL connection configuration properties
     _SASL_PROPS = set(['x-username', 'x-password', 'x-require-auth',
@@ -119,12 +285,149 @@ class Connection(Endpoint):
                      'verify-cert': proton.SSLDomain.VERIFY_PEER,
                      'no-verify': proton.SSLDomain.ANONYMOUS_PEER}
 
+    def __init__(self, properties=None):
+        if properties and properties.get("x-capture-file"):
+            raise Exception("Invalid x-capture-file: a capture file cannot"
+                            " be shared by Connections")
+        self._compile(properties)
+
+    @classmethod
+    def _for_connection(cls, properties):
+        """Compile the properties map of a single Connection."""
+        config = cls.__new__(cls)
+        config._compile(properties)
+        return config
+
+    def _compile(self, properties):
+        # copied, so later changes by the caller cannot make the map and
+        # the compiled configuration disagree:
+        properties = dict(properties or {})
+        self._properties = properties
+        old_flag = properties.get('x-ssl-server', False)
+        self._server = properties.get('x-server', old_flag)
+
+        self._trace_size = properties.get("x-trace-buffer")
+        self._trace_sample = properties.get("x-trace-sample", 1)
+        if self._trace_size and self._trace_sample < 1:
+            raise Exception("Invalid x-trace-sample: %s" %
+                            self._trace_sample)
+
+        sasl_config = self._SASL_PROPS.intersection(properties)
+        # if x-force-sasl is false ignore it so it does not enable SASL
+        if not properties.get('x-force-sasl', True):
+            sasl_config.discard('x-force-sasl')
+        self._sasl = bool(sasl_config)
+        self._sasl_mechs = properties.get('x-sasl-mechs')
+        # maintain old behavior: allow PLAIN and ANONYMOUS authentication
+        # unless x-sasl-mechs excludes both:
+        self._sasl_insecure = True
+        if self._sasl_mechs is not None and _PROTON_VERSION >= (0, 10):
+            self._sasl_mechs = self._sasl_mechs.upper()
+            if ('PLAIN' not in self._sasl_mechs and
+                    'ANONYMOUS' not in self._sasl_mechs):
+                self._sasl_insecure = False
+
+        self._ssl_key = None
+        self._ssl_identity = None
+        self._ssl_peer_name = None
+        self._ssl_session_id = None
+        if not self._SSL_PROPS.isdisjoint(properties):
+            self._configure_ssl(properties)
+        session_id = properties.get('x-ssl-session-id')
+        if session_id:
+            if not self._ssl_key:
+                raise Exception("Invalid x-ssl-session-id: SSL is not"
+                                " configured")
+            if self._ssl_key[0] == proton.SSLDomain.MODE_SERVER:
+                raise Exception("Invalid x-ssl-session-id: not supported"
+                                " by server connections")
+            if session_id is True:
+                # derive the session from the peer:
+                if not self._ssl_peer_name:
+                    raise Exception("Invalid x-ssl-session-id: requires"
+                                    " x-ssl-peer-name or hostname")
+                session_id = self._ssl_peer_name
+            self._ssl_session_id = str(session_id)
+
+    @property
+    def properties(self):
+        """Return a copy of the properties map."""
+        return dict(self._properties)
+
+    @property
+    def server(self):
+        """True if the configuration is for server side Connections."""
+        return bool(self._server)
+
+    def _configure_ssl(self, properties):
+        mode = proton.SSLDomain.MODE_CLIENT
+        if properties.get('x-ssl-server', properties.get('x-server')):
+            mode = proton.SSLDomain.MODE_SERVER
+
+        identity = properties.get('x-ssl-identity')
+        ca_file = properties.get('x-ssl-ca-file')
+        if (not ca_file and properties.get('x-ssl') and
+                hasattr(ssl, 'get_default_verify_paths')):
+            ca_file = ssl.get_default_verify_paths().cafile
+        hostname = properties.get('x-ssl-peer-name',
+                                  properties.get('hostname'))
+        # default to most secure level of certificate validation
+        if not ca_file:
+            vdefault = 'no-verify'
+        elif not hostname:
+            vdefault = 'verify-cert'
+        else:
+            vdefault = 'verify-peer'
+
+        vmode = properties.get('x-ssl-verify-mode', vdefault)
+        try:
+            vmode = self._VERIFY_MODES[vmode]
+        except KeyError:
+            raise proton.SSLException("bad value for x-ssl-verify-mode: '%s'" %
+                                      vmode)
+        if vmode == proton.SSLDomain.VERIFY_PEER_NAME:
+            if not hostname or not ca_file:
+                raise proton.SSLException("verify-peer needs x-ssl-peer-name"
+                                          " and x-ssl-ca-file")
+        elif vmode == proton.SSLDomain.VERIFY_PEER:
+            if not ca_file:
+                raise proton.SSLException("verify-cert needs x-ssl-ca-file")
+
+        cleartext = (mode == proton.SSLDomain.MODE_SERVER and
+                     bool(properties.get('x-ssl-allow-cleartext')))
+        self._ssl_identity = tuple(identity) if identity else None
+        self._ssl_key = _ssl_domain_key(mode, self._ssl_identity, ca_file,
+                                        vmode, cleartext)
+        self._ssl_peer_name = hostname
+        # fail now rather than when the first connection is created:
+        _get_ssl_domain(self._ssl_key, self._ssl_identity)
+
+
+class Connection(Endpoint):
+    """A Connection to a peer."""
+    __slots__ = ("_transport_bound", "_container", "_handler", "_properties",
+                 "_server", "_pn_connection", "_pn_transport", "_pn_collector",
+                 "_sender_links", "_receiver_links", "_timers",
+                 "_timers_heap", "_read_done", "_write_done", "_error",
+                 "_next_deadline", "_work_pending", "_credit_dirty",
+                 "_bytes_in", "_bytes_out", "_loop_monitor",
+                 "_user_context", "_remote_session_id", "_links_per_session",
+                 "_shared_session", "_session_capacity", "_session_window",
+                 "_window_tuner", "_in_callback", "_profiler", "_pn_sasl",
+                 "_sasl_done", "_trace", "_capture",
+                 "_pn_ssl")
+
+    EOS = -1   # indicates 'I/O stream closed'
+
     def _not_reentrant(func):
         """Decorator that prevents callbacks from calling into methods that are
         not reentrant
         """
+        if not _CHECK_REENTRANCY:
+            return func
+
         def wrap(self, *args, **kws):
-            if self._callback_lock and self._callback_lock.in_callback:
+            if self._in_callback:
                 m = "Connection %s cannot be invoked from a callback!" % func
                 raise RuntimeError(m)
             return func(self, *args, **kws)
@@ -133,8 +436,8 @@ class Connection(Endpoint):
     def __init__(self, container, name, event_handler=None, properties=None):
         """Create a new connection from the Container
 
-        properties: map, properties of the new connection. The following keys
-        and values are supported:
+        properties: map or ConnectionConfig, properties of the new
+        connection. The following keys and values are supported:
 
         idle-time-out: float, time in seconds before an idle link will be
         closed.
@@ -219,16 +522,71 @@ class Connection(Endpoint):
         SSL (eg, plain TCP). Used by a server that will accept clients
         requesting either trusted or untrusted connections.
 
+        x-ssl-session-id: string, or True to use the peer's name (see
+        x-ssl-peer-name).  Client connections with the same session id and
+        SSL configuration resume the SSL session of the last such connection
+        that was closed cleanly, skipping the full handshake if the server
+        allows it.  See the ssl_resumed property.
+
+        The SSL domain built from the x-ssl-* properties is cached and shared
+        by all connections with the same SSL configuration.  The most recently
+        used domains are kept.  Call clear_ssl_domains() after the certificate
+        files have changed.
+
         x-trace-protocol: boolean, if true, dump sent and received frames to
         stdout.
+
+        x-trace-buffer: int, if set, keep the given number of the most recent
+        sent and received frames in memory instead of dumping them to stdout.
+        The buffer is logged when the connection fails, or on demand by
+        calling dump_trace().
+
+        x-trace-sample: int, if set, only one in every x-trace-sample frames
+        is kept in the trace buffer.  The default (1) keeps every frame.
+
+        x-links-per-session: int, the number of locally created links that
+        may share a single session.  The default (1) creates a new session for
+        each link.
+
+        x-session-incoming-capacity: int, the number of bytes of incoming
+        data each session may buffer.  This determines the session's incoming
+        window (capacity / max-frame-size frames).  By default the window is
+        not limited.  Unless x-streaming is used on the receive links, the
+        capacity must be larger than the largest message to be received.
+
+        x-session-outgoing-window: int, the outgoing window of each session in
+        frames.
+
+        x-session-autotune: boolean or map, periodically adjust the incoming
+        capacity of each session: it is doubled when the peer fills at least
+        half of the window between calls to process(), and halved when the
+        data buffered by all sessions exceeds the memory limit.  The map may
+        contain "interval" (seconds, default 1.0), "min-capacity" (default
+        the initial capacity), "max-capacity" (default 64 times the initial
+        capacity) and "memory-limit" (bytes, default no limit).  The initial
+        capacity is x-session-incoming-capacity, or 1MB if not given.
+
+        x-callback-profiler: a pyngus.CallbackProfiler instance that times
+        every callback made by the connection and its links.
+
+        x-capture-file: a path or a binary file object.  If set, the data
+        passed to process_input() and output_written() is recorded in a
+        capture file.  See pyngus.capture.  Not accepted by ConnectionConfig.
+
+        x-loop-monitor: a pyngus.LoopMonitor instance that records the time
+        spent reading, processing and writing, and how late process() is
+        called after the deadline has expired.
         """
+        if isinstance(properties, ConnectionConfig):
+            config = properties
+        else:
+            config = ConnectionConfig._for_connection(properties)
         super(Connection, self).__init__(name)
         self._transport_bound = False
         self._container = container
         self._handler = event_handler
-        self._properties = properties or {}
-        old_flag = self._properties.get('x-ssl-server', False)
-        self._server = self._properties.get('x-server', old_flag)
+        self._properties = config._properties
+        self._server = config._server
 
         self._pn_connection = proton.Connection()
         self._pn_connection.container = container.name
@@ -253,7 +611,16 @@ class Connection(Endpoint):
             self._pn_transport.max_frame_size = max_frame
         if 'properties' in self._properties:
             self._pn_connection.properties = self._properties["properties"]
-        if self._properties.get("x-trace-protocol"):
+        self._trace = None
+        if config._trace_size:
+            self._trace = _TraceBuffer(config._trace_size,
+                                       config._trace_sample)
+            if _set_pytracer:
+                _set_pytracer(self._pn_transport._impl, self._trace)
+            else:
+                self._pn_transport.tracer = self._trace
+            self._pn_transport.trace(proton.Transport.TRACE_FRM)
+        elif self._properties.get("x-trace-protocol"):
             self._pn_transport.trace(proton.Transport.TRACE_FRM)
 
         # indexed by link-name
@@ -267,43 +634,55 @@ class Connection(Endpoint):
         self._write_done = False
         self._error = None
         self._next_deadline = 0
+        self._work_pending = False
+        self._credit_dirty = []  # links with unprocessed flow updates
+        self._bytes_in = 0
+        self._bytes_out = 0
         self._user_context = None
         self._remote_session_id = 0
-        self._callback_lock = _CallbackLock()
+        self._links_per_session = self._properties.get("x-links-per-session",
+                                                       1)
+        self._shared_session = None  # accepts new links if not full
+        self._session_capacity = self._properties.get(
+            "x-session-incoming-capacity")
+        self._session_window = self._properties.get(
+            "x-session-outgoing-window")
+        self._window_tuner = None
+        autotune = self._properties.get("x-session-autotune")
+        if autotune:
+            if not self._session_capacity:
+                self._session_capacity = self._AUTOTUNE_CAPACITY
+            self._window_tuner = _WindowTuner(autotune,
+                                              self._session_capacity)
+        self._in_callback = 0  # depth of nested callbacks
+        self._profiler = self._properties.get("x-callback-profiler")
+        self._loop_monitor = self._properties.get("x-loop-monitor")
+        self._capture = None
 
         self._pn_sasl = None
         self._sasl_done = False
 
-        # if x-force-sasl is false remove it so it does not trigger the SASL
-        # configuration logic below
-        if not self._properties.get('x-force-sasl', True):
-            del self._properties['x-force-sasl']
-
-        if self._SASL_PROPS.intersection(set(self._properties.keys())):
+        if config._sasl:
             # SASL config specified, need to enable SASL
+            pn_sasl = self.pn_sasl
             if (_PROTON_VERSION < (0, 10)):
                 # best effort map of 0.10 sasl config to pre-0.10 sasl
                 if self._server:
-                    self.pn_sasl.server()
+                    pn_sasl.server()
                     if 'x-require-auth' in self._properties:
                         if not self._properties['x-require-auth']:
                             if _PROTON_VERSION >= (0, 8):
-                                self.pn_sasl.allow_skip()
+                                pn_sasl.allow_skip()
                 else:
                     if 'x-username' in self._properties:
-                        self.pn_sasl.plain(self._properties['x-username'],
-                                           self._properties.get('x-password',
-                                                                ''))
+                        pn_sasl.plain(self._properties['x-username'],
+                                      self._properties.get('x-password', ''))
                     else:
-                        self.pn_sasl.client()
-                mechs = self._properties.get('x-sasl-mechs')
-                if mechs:
-                    self.pn_sasl.mechanisms(mechs)
+                        pn_sasl.client()
+                if config._sasl_mechs:
+                    pn_sasl.mechanisms(config._sasl_mechs)
             else:
                 # new Proton SASL configuration:
-                # maintain old behavior: allow PLAIN and ANONYMOUS
-                # authentication.  Override this using x-sasl-mechs below:
-                self.pn_sasl.allow_insecure_mechs = True
                 if 'x-require-auth' in self._properties:
                     ra = self._properties['x-require-auth']
                     self._pn_transport.require_auth(ra)
@@ -312,25 +691,35 @@ class Connection(Endpoint):
                 if 'x-password' in self._properties:
                     self._pn_connection.password = \
                         self._properties['x-password']
-                if 'x-sasl-mechs' in self._properties:
-                    mechs = self._properties['x-sasl-mechs'].upper()
-                    self.pn_sasl.allowed_mechs(mechs)
-                    if 'PLAIN' not in mechs and 'ANONYMOUS' not in mechs:
-                        self.pn_sasl.allow_insecure_mechs = False
+                if config._sasl_mechs is not None:
+                    pn_sasl.allowed_mechs(config._sasl_mechs)
+                pn_sasl.allow_insecure_mechs = config._sasl_insecure
                 if 'x-sasl-config-dir' in self._properties:
-                    self.pn_sasl.config_path(
+                    pn_sasl.config_path(
                         self._properties['x-sasl-config-dir'])
                 if 'x-sasl-config-name' in self._properties:
-                    self.pn_sasl.config_name(
+                    pn_sasl.config_name(
                         self._properties['x-sasl-config-name'])
 
-        # intercept any SSL failures and cleanup resources before propagating
-        # the exception:
-        try:
-            self._pn_ssl = self._configure_ssl(properties)
-        except Exception:
-            self.destroy()
-            raise
+        self._pn_ssl = None
+        if config._ssl_key:
+            # intercept any SSL failures and cleanup resources before
+            # propagating the exception:
+            try:
+                self._pn_ssl = self._configure_ssl(config)
+            except Exception:
+                self.destroy()
+                raise
+
+        capture = self._properties.get("x-capture-file")
+        if capture:
+            if self._pn_ssl:
+                LOG.warning("Connection %s: captured traffic is encrypted"
+                            " and cannot be replayed", name)
+            info = {"name": name,
+                    "x-server": bool(self._server),
+                    "x-sasl-mechs": self._properties.get("x-sasl-mechs")}
+            self._capture = _CaptureFile(capture, info)
 
     @property
     def container(self):
@@ -381,6 +770,14 @@ class Connection(Endpoint):
         """Return the Proton SSL context for this Connection."""
         return self._pn_ssl
 
+    @property
+    def ssl_resumed(self):
+        """True if the SSL session was resumed from a previous connection
+        (see the x-ssl-session-id property).
+        """
+        return bool(self._pn_ssl and
+                    self._pn_ssl.resume_status() == proton.SSL.RESUME_REUSED)
+
     def _get_user_context(self):
         return self._user_context
 
@@ -427,20 +824,22 @@ class Connection(Endpoint):
         self._error = "Destroyed by the application"
         self._handler = None
         self._properties = None
-        tmp = self._sender_links.copy()
-        for link in tmp.values():
-            link.destroy()
-        assert(len(self._sender_links) == 0)
-        tmp = self._receiver_links.copy()
-        for link in tmp.values():
-            link.destroy()
-        assert(len(self._receiver_links) == 0)
+        if self._sender_links:
+            for link in list(self._sender_links.values()):
+                link.destroy()
+            assert(len(self._sender_links) == 0)
+        if self._receiver_links:
+            for link in list(self._receiver_links.values()):
+                link.destroy()
+            assert(len(self._receiver_links) == 0)
         self._timers.clear()
         self._timers_heap = None
         self._container.remove_connection(self._name)
         self._container = None
         self._user_context = None
-        self._callback_lock = None
+        if self._capture:
+            self._capture.close()
+            self._capture = None
         if self._transport_bound:
             self._pn_transport.unbind()
         self._pn_transport = None
@@ -451,6 +850,8 @@ class Connection(Endpoint):
             while self._pn_collector.peek():
                 self._pn_collector.pop()
         self._pn_collector = None
+        self._credit_dirty = []
+        self._shared_session = None
         self._pn_sasl = None
         self._pn_ssl = None
 
@@ -458,8 +859,21 @@ class Connection(Endpoint):
     _ACTIVE = (proton.Endpoint.LOCAL_ACTIVE | proton.Endpoint.REMOTE_ACTIVE)
 
     @_not_reentrant
-    def process(self, now):
-        """Perform connection state processing."""
+    def process(self, now, max_events=None, max_time=None):
+        """Perform connection state processing.
+
+        If max_events is given, no more than max_events protocol events are
+        handled by this call.  If max_time is given, event handling stops
+        once max_time seconds have elapsed.  When processing stops early the
+        work_pending property is set and the returned deadline is 'now': the
+        application should call process() again soon.
+        """
+        monitor = self._loop_monitor
+        if monitor is None:
+            return self._process(now, max_events, max_time)
+        return monitor._process(self, now, max_events, max_time)
+
+    def _process(self, now, max_events, max_time):
         if self._pn_connection is None:
             LOG.error("Connection.process() called on destroyed connection!")
             return 0
@@ -476,22 +890,20 @@ class Connection(Endpoint):
                     LOG.debug("SASL in progress. State=%s",
                               str(self._pn_sasl.state))
                     if self._handler:
-                        with self._callback_lock:
-                            self._handler.sasl_step(self, self._pn_sasl)
+                        self._callback(self._handler.sasl_step, self,
+                                       self._pn_sasl)
                     return self._next_deadline
 
                 self._sasl_done = True
                 if self._handler:
-                    with self._callback_lock:
-                        self._handler.sasl_done(self, self._pn_sasl,
-                                                self._pn_sasl.outcome)
+                    self._callback(self._handler.sasl_done, self,
+                                   self._pn_sasl, self._pn_sasl.outcome)
             else:
                 if self._pn_sasl.outcome is not None:
                     self._sasl_done = True
                     if self._handler:
-                        with self._callback_lock:
-                            self._handler.sasl_done(self, self._pn_sasl,
-                                                    self._pn_sasl.outcome)
+                        self._callback(self._handler.sasl_done, self,
+                                       self._pn_sasl, self._pn_sasl.outcome)
 
         # process timer events:
         timer_deadline = self._expire_timers(now)
@@ -501,18 +913,38 @@ class Connection(Endpoint):
         else:
             self._next_deadline = timer_deadline or transport_deadline
 
+        tuner = self._window_tuner
+        if tuner and now >= tuner.deadline:
+            tuner.tune(self._pn_connection, now)
+
         # process events from proton:
-        pn_event = self._pn_collector.peek()
-        while pn_event:
-            # LOG.debug("pn_event: %s received", pn_event.type)
-            if _Link._handle_proton_event(pn_event, self):
-                pass
-            elif self._handle_proton_event(pn_event):
-                pass
-            elif _SessionProxy._handle_proton_event(pn_event, self):
-                pass
-            self._pn_collector.pop()
-            pn_event = self._pn_collector.peek()
+        handlers = self._EVENT_HANDLERS
+        collector = self._pn_collector
+        _skip_events(collector)
+        pn_event = collector.peek()
+        if max_events is None and max_time is None:
+            while pn_event:
+                # LOG.debug("pn_event: %s received", pn_event.type)
+                handler = handlers.get(pn_event.type)
+                if handler:
+                    handler(self, pn_event)
+                collector.pop()
+                _skip_events(collector)
+                pn_event = collector.peek()
+        else:
+            pn_event = self._process_budget(handlers, collector, pn_event,
+                                            max_events, max_time)
+
+        if self._credit_dirty:
+            self._process_credit()
+
+        self._work_pending = pn_event is not None
+        if self._work_pending:
+            # budget exhausted, come back as soon as possible
+            self._next_deadline = now
+            self._container._schedule_pending(self)
+            if not self._error:
+                return self._next_deadline
 
         # check for connection failure after processing all pending
         # engine events:
@@ -520,18 +952,93 @@ class Connection(Endpoint):
             if self._handler:
                 # nag application until connection is destroyed
                 self._next_deadline = now
-                with self._callback_lock:
-                    self._handler.connection_failed(self, self._error)
+                self._callback(self._handler.connection_failed, self,
+                               self._error)
         elif (self._endpoint_state == self._CLOSED and
               self._read_done and self._write_done):
             # invoke closed callback after endpoint has fully closed and
             # all pending I/O has completed:
             if self._handler:
-                with self._callback_lock:
-                    self._handler.connection_closed(self)
+                self._callback(self._handler.connection_closed, self)
 
         return self._next_deadline
 
+    def _process_budget(self, handlers, collector, pn_event,
+                        max_events, max_time):
+        """Handle events until the collector is drained or the budget is
+        exhausted.  Returns the first unhandled event, if any.
+        """
+        count = 0
+        stop = time.time() + max_time if max_time is not None else None
+        while pn_event:
+            handler = handlers.get(pn_event.type)
+            if handler:
+                handler(self, pn_event)
+            collector.pop()
+            count += 1 + _skip_events(collector)
+            pn_event = collector.peek()
+            if max_events is not None and count >= max_events:
+                break
+            if stop is not None and time.time() >= stop:
+                break
+        return pn_event
+
+    def _callback(self, method, *args):
+        """Invoke an application callback.  Non-reentrant methods will raise
+        a RuntimeError if called by the callback.
+        """
+        self._in_callback += 1
+        try:
+            if self._profiler is None:
+                return method(*args)
+            return self._profiler._call(self, method, args)
+        finally:
+            self._in_callback -= 1
+
+    def _process_credit(self):
+        """Run credit processing once for each link that received a flow
+        update during this pass.
+        """
+        links = self._credit_dirty
+        self._credit_dirty = []
+        for link in links:
+            link._credit_dirty = False
+            if link._pn_link is not None:  # not destroyed by a callback
+                link._process_credit()
+
+    def stats(self):
+        """Return a map of the connection's counters: the bytes and AMQP
+        frames transferred in each direction, and the number of links.
+        """
+        transport = self._pn_transport
+        return {"bytes-in": self._bytes_in,
+                "bytes-out": self._bytes_out,
+                "frames-in": transport.frames_input if transport else 0,
+                "frames-out": transport.frames_output if transport else 0,
+                "senders": len(self._sender_links),
+                "receivers": len(self._receiver_links)}
+
+    @property
+    def trace_frames(self):
+        """A list of the (timestamp, frame) tuples held in the trace buffer,
+        oldest first.  Empty if the x-trace-buffer property is not set.
+        """
+        return list(self._trace.frames) if self._trace else []
+
+    def dump_trace(self, level=logging.INFO):
+        """Log the frames held in the trace buffer."""
+        if self._trace:
+            lines = ["%.6f %s" % frame for frame in self._trace.frames]
+            LOG.log(level, "Connection %s: last %d traced frames:\n%s",
+                    self._name, len(lines), "\n".join(lines))
+
+    @property
+    def work_pending(self):
+        """True if the last call to process() stopped before all pending
+        protocol events were handled.
+        """
+        return self._work_pending
+
     @property
     def next_tick(self):
         text = "next_tick deprecated, use deadline instead"
@@ -574,6 +1081,9 @@ class Connection(Endpoint):
             LOG.debug("process_input read done")
             self._read_done = True
             return self.EOS
+        self._bytes_in += c
+        if self._capture:
+            self._capture.record(_CAPTURE_INPUT, in_data[:c])
         # hack: check if this was the last input needed by the connection.
         # If so, this will set the _read_done flag and the 'connection closed'
         # callback can be issued on the next call to process()
@@ -582,6 +1092,8 @@ class Connection(Endpoint):
 
     def close_input(self, reason=None):
         if not self._read_done:
+            if self._capture:
+                self._capture.record(_CAPTURE_INPUT, b"")
             try:
                 self._pn_transport.close_tail()
             except Exception as e:
@@ -620,11 +1132,18 @@ class Connection(Endpoint):
         return buf
 
     def output_written(self, count):
+        data = None
         try:
+            if self._capture and count > 0:
+                data = self._pn_transport.peek(count)
             self._pn_transport.pop(count)
         except Exception as e:
             self._write_done = True
             self._connection_failed(str(e))
+        else:
+            self._bytes_out += count
+            if data is not None:
+                self._capture.record(_CAPTURE_OUTPUT, data)
         # hack: check if this was the last output from the connection.  If so,
         # this will set the _write_done flag and the 'connection closed'
         # callback can be issued on the next call to process()
@@ -632,6 +1151,8 @@ class Connection(Endpoint):
 
     def close_output(self, reason=None):
         if not self._write_done:
+            if self._capture:
+                self._capture.record(_CAPTURE_OUTPUT, b"")
             try:
                 self._pn_transport.close_head()
             except Exception as e:
@@ -646,13 +1167,33 @@ class Connection(Endpoint):
         if ident in self._sender_links:
             raise KeyError("Sender %s already exists!" % ident)
 
-        session = _SessionProxy("session-%s" % ident, self)
-        session.open()
+        session = self._get_session(ident)
         sl = session.new_sender(ident)
         sl.configure(target_address, source_address, event_handler, properties)
         self._sender_links[ident] = sl
         return sl
 
+    # initial session capacity if x-session-autotune is enabled without an
+    # x-session-incoming-capacity
+    _AUTOTUNE_CAPACITY = 1024 * 1024
+
+    _SESSION_DONE = (proton.Endpoint.LOCAL_CLOSED |
+                     proton.Endpoint.REMOTE_CLOSED)
+
+    def _get_session(self, ident):
+        """Return an open session for a new locally created link.  Up to
+        x-links-per-session links share the same session.
+        """
+        session = self._shared_session
+        if (session is None or session._pn_session is None or
+                session._pn_session.state & self._SESSION_DONE or
+                len(session._links) >= self._links_per_session):
+            session = _SessionProxy("session-%s" % ident, self)
+            session.open()
+            if self._links_per_session > 1:
+                self._shared_session = session
+        return session
+
     def accept_sender(self, link_handle, source_override=None,
                       event_handler=None, properties=None):
         link = self._sender_links.get(link_handle)
@@ -685,8 +1226,7 @@ class Connection(Endpoint):
         if ident in self._receiver_links:
             raise KeyError("Receiver %s already exists!" % ident)
 
-        session = _SessionProxy("session-%s" % ident, self)
-        session.open()
+        session = self._get_session(ident)
         rl = session.new_receiver(ident)
         rl.configure(target_address, source_address, event_handler, properties)
         self._receiver_links[ident] = rl
@@ -733,60 +1273,16 @@ class Connection(Endpoint):
         if not self._error:
             LOG.error("Connection failed: %s", str(error))
             self._error = error
-
-    def _configure_ssl(self, properties):
-        if (not properties or
-                not self._SSL_PROPS.intersection(set(iter(properties)))):
-            return None
-
-        mode = proton.SSLDomain.MODE_CLIENT
-        if properties.get('x-ssl-server', properties.get('x-server')):
-            mode = proton.SSLDomain.MODE_SERVER
-
-        identity = properties.get('x-ssl-identity')
-        ca_file = properties.get('x-ssl-ca-file')
-        if (not ca_file and properties.get('x-ssl') and
-                hasattr(ssl, 'get_default_verify_paths')):
-            ca_file = ssl.get_default_verify_paths().cafile
-        hostname = properties.get('x-ssl-peer-name',
-                                  properties.get('hostname'))
-        # default to most secure level of certificate validation
-        if not ca_file:
-            vdefault = 'no-verify'
-        elif not hostname:
-            vdefault = 'verify-cert'
-        else:
-            vdefault = 'verify-peer'
-
-        vmode = properties.get('x-ssl-verify-mode', vdefault)
-        try:
-            vmode = self._VERIFY_MODES[vmode]
-        except KeyError:
-            raise proton.SSLException("bad value for x-ssl-verify-mode: '%s'" %
-                                      vmode)
-        if vmode == proton.SSLDomain.VERIFY_PEER_NAME:
-            if not hostname or not ca_file:
-                raise proton.SSLException("verify-peer needs x-ssl-peer-name"
-                                          " and x-ssl-ca-file")
-        elif vmode == proton.SSLDomain.VERIFY_PEER:
-            if not ca_file:
-                raise proton.SSLException("verify-cert needs x-ssl-ca-file")
-
-        # This will throw proton.SSLUnavailable if SSL support is not installed
-        domain = proton.SSLDomain(mode)
-        if identity:
-            # our identity:
-            domain.set_credentials(identity[0], identity[1], identity[2])
-        if ca_file:
-            # how we verify peers:
-            domain.set_trusted_ca_db(ca_file)
-        domain.set_peer_authentication(vmode, ca_file)
-        if mode == proton.SSLDomain.MODE_SERVER:
-            if properties.get('x-ssl-allow-cleartext'):
-                domain.allow_unsecured_client()
-        pn_ssl = proton.SSL(self._pn_transport, domain)
-        if hostname:
-            pn_ssl.peer_hostname = hostname
+            self.dump_trace(logging.ERROR)
+
+    def _configure_ssl(self, config):
+        domain = _get_ssl_domain(config._ssl_key, config._ssl_identity)
+        details = None
+        if config._ssl_session_id:
+            details = proton.SSLSessionDetails(config._ssl_session_id)
+        pn_ssl = proton.SSL(self._pn_transport, domain, details)
+        if config._ssl_peer_name:
+            pn_ssl.peer_hostname = config._ssl_peer_name
         LOG.debug("SSL configured for connection %s", self._name)
         return pn_ssl
 
@@ -825,19 +1321,26 @@ class Connection(Endpoint):
             proton.Event.CONNECTION_LOCAL_OPEN: Endpoint.LOCAL_OPENED,
             proton.Event.CONNECTION_LOCAL_CLOSE: Endpoint.LOCAL_CLOSED}
 
-        def _handle_proton_event(self, pn_event):
-            ep_event = Connection._endpoint_event_map.get(pn_event.type)
-            if ep_event is not None:
-                self._process_endpoint_event(ep_event)
-            elif pn_event.type == proton.Event.CONNECTION_INIT:
-                LOG.debug("Connection created: %s", pn_event.context)
-            elif pn_event.type == proton.Event.CONNECTION_FINAL:
-                LOG.debug("Connection finalized: %s", pn_event.context)
-            elif pn_event.type == proton.Event.TRANSPORT_ERROR:
-                self._connection_failed(str(self._pn_transport.condition))
-            else:
-                return False  # unknown
-            return True  # handled
+        def _on_endpoint_event(self, pn_event):
+            ep_event = Connection._endpoint_event_map[pn_event.type]
+            self._process_endpoint_event(ep_event)
+
+        def _on_connection_init(self, pn_event):
+            LOG.debug("Connection created: %s", pn_event.context)
+
+        def _on_connection_final(self, pn_event):
+            LOG.debug("Connection finalized: %s", pn_event.context)
+
+        def _on_transport_error(self, pn_event):
+            self._connection_failed(str(self._pn_transport.condition))
+
+        # Dispatch table used by process(), indexed by proton event type.
+        # Each handler is invoked as handler(connection, pn_event):
+        _EVENT_HANDLERS = dict.fromkeys(_endpoint_event_map,
+                                        _on_endpoint_event)
+        _EVENT_HANDLERS[proton.Event.CONNECTION_INIT] = _on_connection_init
+        _EVENT_HANDLERS[proton.Event.CONNECTION_FINAL] = _on_connection_final
+        _EVENT_HANDLERS[proton.Event.TRANSPORT_ERROR] = _on_transport_error
     elif hasattr(proton.Event, "CONNECTION_LOCAL_STATE"):
         # 0.7 proton event model
         def _handle_proton_event(self, pn_event):
@@ -845,28 +1348,32 @@ class Connection(Endpoint):
                 self._process_local_state()
             elif pn_event.type == proton.Event.CONNECTION_REMOTE_STATE:
                 self._process_remote_state()
-            else:
-                return False  # unknown
-            return True  # handled
+
+        _EVENT_HANDLERS = dict.fromkeys([
+            proton.Event.CONNECTION_LOCAL_STATE,
+            proton.Event.CONNECTION_REMOTE_STATE], _handle_proton_event)
     else:
         raise Exception("The installed version of Proton is not supported.")
 
+    _EVENT_HANDLERS.update(_SessionProxy._event_handlers())
+    _EVENT_HANDLERS.update(_Link._event_handlers())
+    _EVENT_NUMBERS = frozenset(getattr(t, "number", t)
+                               for t in _EVENT_HANDLERS)
+
     # endpoint state machine actions:
 
     def _ep_active(self):
         """Both ends of the Endpoint have become active."""
         LOG.debug("Connection is up")
         if self._handler:
-            with self._callback_lock:
-                self._handler.connection_active(self)
+            self._callback(self._handler.connection_active, self)
 
     def _ep_need_close(self):
         """The remote has closed its end of the endpoint."""
         LOG.debug("Connection remotely closed")
         if self._handler:
             cond = self._pn_connection.remote_condition
-            with self._callback_lock:
-                self._handler.connection_remote_closed(self, cond)
+            self._callback(self._handler.connection_remote_closed, self, cond)
 
     def _ep_error(self, error):
         """The endpoint state machine failed due to protocol error."""
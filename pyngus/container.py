@@ -18,8 +18,9 @@ __all__ = [
     "Container"
 ]
 
-import heapq
+import collections
 import logging
+import operator
 
 from pyngus.connection import Connection
 
@@ -32,6 +33,9 @@ class Container(object):
         self._name = name
         self._connections = {}
         self._properties = properties
+        # connections with work left over by a budgeted process() call, in
+        # the order they will be serviced:
+        self._pending = collections.OrderedDict()
 
     def destroy(self):
         conns = list(self._connections.values())
@@ -59,21 +63,63 @@ class Container(object):
         """
         readers = []
         writers = []
-        timer_heap = []
+        timers = []
         for c in iter(self._connections.values()):
             if c.needs_input > 0:
                 readers.append(c)
             if c.has_output > 0:
                 writers.append(c)
             if c.deadline:
-                heapq.heappush(timer_heap, (c.next_tick, c))
-        timers = []
-        while timer_heap:
-            x = heapq.heappop(timer_heap)
-            timers.append(x[1])
+                timers.append(c)
+        # sort by deadline only: connections with equal deadlines are not
+        # compared
+        timers.sort(key=operator.attrgetter("deadline"))
 
         return (readers, writers, timers)
 
+    def process_pending(self, now, max_events=None, max_time=None):
+        """Call process() on each Connection that has work pending from an
+        earlier process() call that ran out of budget.  Each Connection gets
+        the given budget, and is serviced in round-robin order: those that
+        still have work pending afterwards are moved to the end of the
+        queue.  Returns the list of Connections that still have work pending.
+        """
+        for name in list(self._pending.keys()):
+            conn = self._pending.pop(name, None)
+            if conn and conn.work_pending:
+                # re-queued by process() if work remains
+                conn.process(now, max_events, max_time)
+        return list(self._pending.values())
+
+    def _schedule_pending(self, connection):
+        name = connection.name
+        if name in self._pending:
+            del self._pending[name]
+        self._pending[name] = connection
+
+    def stats(self):
+        """Return the totals of the stats() counters of all Connections
+        ("connections"), of their SenderLinks ("senders") and of their
+        ReceiverLinks ("receivers").
+        """
+        def _add(totals, stats):
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+
+        conn_totals = {}
+        sender_totals = {}
+        receiver_totals = {}
+        for conn in self._connections.values():
+            _add(conn_totals, conn.stats())
+            for link in conn._sender_links.values():
+                _add(sender_totals, link.stats())
+            for link in conn._receiver_links.values():
+                _add(receiver_totals, link.stats())
+        conn_totals["count"] = len(self._connections)
+        return {"connections": conn_totals,
+                "senders": sender_totals,
+                "receivers": receiver_totals}
+
     def resolve_sender(self, target_address):
         pass
 
@@ -86,3 +132,4 @@ class Container(object):
     def remove_connection(self, name):
         if name in self._connections:
             del self._connections[name]
+        self._pending.pop(name, None)
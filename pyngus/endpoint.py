@@ -16,6 +16,7 @@
 #    under the License.
 
 import logging
+import os
 import proton
 
 LOG = logging.getLogger(__name__)
@@ -23,10 +24,18 @@ LOG = logging.getLogger(__name__)
 _PROTON_VERSION = (int(getattr(proton, "VERSION_MAJOR", 0)),
                    int(getattr(proton, "VERSION_MINOR", 0)))
 
+# The public methods that must not be called from a callback are guarded by a
+# check.  Trusted deployments can remove these checks by setting
+# PYNGUS_NO_REENTRANCY_CHECKS in the environment before pyngus is imported.
+_CHECK_REENTRANCY = not os.environ.get("PYNGUS_NO_REENTRANCY_CHECKS")
+
 
 class Endpoint(object):
     """AMQP Endpoint state machine."""
 
+    __slots__ = ("_name", "_state", "_local_events", "_remote_events",
+                 "__weakref__")
+
     # Endpoint States:
     STATE_UNINIT = 0  # initial state
     STATE_PENDING = 1  # local opened, waiting for remote to open
@@ -0,0 +1,140 @@
+#    Licensed to the Apache Software Foundation (ASF) under one
+#    or more contributor license agreements.  See the NOTICE file
+#    distributed with this work for additional information
+#    regarding copyright ownership.  The ASF licenses this file
+#    to you under the Apache License, Version 2.0 (the
+#    "License"); you may not use this file except in compliance
+#    with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an
+#    "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#    KIND, either express or implied.  See the License for the
+#    specific language governing permissions and limitations
+#    under the License.
+__all__ = [
+    "LatencyHistogram"
+]
+
+
+class LatencyHistogram(object):
+    """A fixed size histogram of latency values, in seconds.
+
+    Values are recorded with microsecond resolution into log-linear buckets:
+    each power of two is split into 32 linear sub-buckets, so any recorded
+    value is reported within about 3% of its true value.  Values above
+    MAX_VALUE seconds are counted in the last bucket.
+    """
+    __slots__ = ("_counts", "_count", "_sum", "_min", "_max")
+
+    _SUB_BITS = 5
+    _SUB_COUNT = 1 << _SUB_BITS   # linear sub-buckets per power of two
+    _LINEAR = 2 * _SUB_COUNT      # values below this have their own bucket
+    _MAX_BITS = 36                # 2^36 usecs, about 19 hours
+    _BUCKETS = _LINEAR + (_MAX_BITS - _SUB_BITS - 1) * _SUB_COUNT
+    MAX_VALUE = ((1 << _MAX_BITS) - 1) / 1000000.0
+
+    def __init__(self):
+        self._counts = [0] * self._BUCKETS
+        self._count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+
+    @classmethod
+    def _index(cls, usecs):
+        if usecs < cls._LINEAR:
+            return usecs
+        shift = usecs.bit_length() - cls._SUB_BITS - 1
+        index = (cls._LINEAR + (shift - 1) * cls._SUB_COUNT +
+                 (usecs >> shift) - cls._SUB_COUNT)
+        return min(index, cls._BUCKETS - 1)
+
+    @classmethod
+    def _upper_bound(cls, index):
+        """The largest value (in usecs) counted by the bucket at index."""
+        if index < cls._LINEAR:
+            return index
+        shift = (index - cls._LINEAR) // cls._SUB_COUNT + 1
+        top = (index - cls._LINEAR) % cls._SUB_COUNT + cls._SUB_COUNT
+        return ((top + 1) << shift) - 1
+
+    def record(self, value):
+        """Record a latency value, in seconds."""
+        if value < 0:
+            value = 0.0
+        self._counts[self._index(int(value * 1000000))] += 1
+        self._count += 1
+        self._sum += value
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    @property
+    def count(self):
+        """The number of recorded values."""
+        return self._count
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        return self._sum / self._count if self._count else None
+
+    def percentile(self, percent):
+        """Return the value (in seconds) at or below which the given percent
+        of the recorded values fall.  Returns None if no values have been
+        recorded.
+        """
+        if not self._count:
+            return None
+        if percent >= 100:
+            return self._max
+        target = max(1, int(round(self._count * percent / 100.0)))
+        total = 0
+        for index, count in enumerate(self._counts):
+            total += count
+            if total >= target:
+                value = self._upper_bound(index) / 1000000.0
+                return min(max(value, self._min), self._max)
+        return self._max
+
+    def merge(self, other):
+        """Add the values recorded by another LatencyHistogram to this
+        histogram.  Returns self.
+        """
+        if other._count:
+            counts = self._counts
+            for index, count in enumerate(other._counts):
+                if count:
+                    counts[index] += count
+            self._count += other._count
+            self._sum += other._sum
+            if self._min is None or other._min < self._min:
+                self._min = other._min
+            if self._max is None or other._max > self._max:
+                self._max = other._max
+        return self
+
+    def reset(self):
+        """Discard all recorded values."""
+        self.__init__()
+
+    def __repr__(self):
+        if not self._count:
+            return "<LatencyHistogram count=0>"
+        return ("<LatencyHistogram count=%d mean=%.6f p50=%.6f p99=%.6f"
+                " p999=%.6f max=%.6f>" % (self._count, self.mean,
+                                          self.percentile(50),
+                                          self.percentile(99),
+                                          self.percentile(99.9),
+                                          self._max))
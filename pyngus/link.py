@@ -25,11 +25,17 @@ __all__ = [
 import collections
 import logging
 import proton
+import time
 
 from pyngus.endpoint import Endpoint
+from pyngus.endpoint import _CHECK_REENTRANCY
+from pyngus.histogram import LatencyHistogram
 
 LOG = logging.getLogger(__name__)
 
+# clock used for latency measurements
+_clock = getattr(time, "monotonic", time.time)
+
 _PROTON_VERSION = (int(getattr(proton, "VERSION_MAJOR", 0)),
                    int(getattr(proton, "VERSION_MINOR", 0)))
 
@@ -43,46 +49,27 @@ _rcv_settle_modes = {"first": proton.Link.RCV_FIRST,
                      "second": proton.Link.RCV_SECOND}
 
 
-# TODO(kgiusti): this is duplicated in connection.py, put in common file
-class _CallbackLock(object):
-    """A utility class for detecting when a callback invokes a non-reentrant
-    Pyngus method.
-    """
-    def __init__(self, link):
-        super(_CallbackLock, self).__init__()
-        self._link = link
-        self.in_callback = 0
-
-    def __enter__(self):
-        # manually lock parent - can't enter its non-reentrant methods
-        self._link._connection._callback_lock.__enter__()
-        self.in_callback += 1
-        return self
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.in_callback -= 1
-        self._link._connection._callback_lock.__exit__(None, None, None)
-        # if a call is made to a non-reentrant method while this context is
-        # held, then the method will raise a RuntimeError().  Return false to
-        # propagate the exception to the caller
-        return False
-
-
 def _not_reentrant(func):
     """Decorator that prevents callbacks from calling into link methods that
     are not reentrant """
-    def wrap(*args, **kws):
-        link = args[0]
-        if link._callback_lock.in_callback:
+    if not _CHECK_REENTRANCY:
+        return func
+
+    def wrap(self, *args, **kws):
+        if self._in_callback:
             m = "Link %s cannot be invoked from a callback!" % func
             raise RuntimeError(m)
-        return func(*args, **kws)
+        return func(self, *args, **kws)
     return wrap
 
 
 class _Link(Endpoint):
     """A generic Link base class."""
 
+    __slots__ = ("_connection", "_handler", "_properties", "_user_context",
+                 "_rejected", "_failed", "_in_callback", "_credit_dirty",
+                 "_pn_link")
+
     def __init__(self, connection, pn_link):
         super(_Link, self).__init__(pn_link.name)
         self._connection = connection
@@ -91,7 +78,8 @@ class _Link(Endpoint):
         self._user_context = None
         self._rejected = False  # requested link was refused
         self._failed = False  # protocol error occurred
-        self._callback_lock = _CallbackLock(self)
+        self._in_callback = 0  # depth of nested callbacks
+        self._credit_dirty = False  # flow update not yet processed
         # TODO(kgiusti): raise jira to add 'context' attr to api
         self._pn_link = pn_link
         pn_link.context = self
@@ -210,7 +198,6 @@ class _Link(Endpoint):
         self._user_context = None
         self._connection = None
         self._handler = None
-        self._callback_lock = None
         if self._pn_link:
             session = self._pn_link.session.context
             self._pn_link.context = None
@@ -218,12 +205,37 @@ class _Link(Endpoint):
             self._pn_link = None
             session.link_destroyed(self)  # destroy session _after_ link
 
+    def _callback(self, method, *args):
+        """Invoke an application callback.  Non-reentrant methods of both
+        the link and its connection will raise a RuntimeError if called by
+        the callback.
+        """
+        connection = self._connection
+        self._in_callback += 1
+        connection._in_callback += 1
+        try:
+            if connection._profiler is None:
+                return method(*args)
+            return connection._profiler._call(connection, method, args)
+        finally:
+            self._in_callback -= 1
+            connection._in_callback -= 1
+
     def _process_delivery(self, pn_delivery):
         raise NotImplementedError("Must Override")
 
     def _process_credit(self):
         raise NotImplementedError("Must Override")
 
+    def _credit_changed(self):
+        """Defer credit processing until the end of the current
+        Connection.process() pass, so that several flow updates cost a
+        single _process_credit() call.
+        """
+        if not self._credit_dirty:
+            self._credit_dirty = True
+            self._connection._credit_dirty.append(self)
+
     def _link_failed(self, error):
         raise NotImplementedError("Must Override")
 
@@ -247,54 +259,64 @@ class _Link(Endpoint):
             proton.Event.LINK_LOCAL_CLOSE: Endpoint.LOCAL_CLOSED}
 
         @staticmethod
-        def _handle_proton_event(pn_event, connection):
-            etype = pn_event.type
-            if etype == proton.Event.DELIVERY:
-                pn_link = pn_event.link
-                pn_link.context and \
-                    pn_link.context._process_delivery(pn_event.delivery)
-                return True
+        def _on_delivery(connection, pn_event):
+            link = pn_event.link.context
+            if link:
+                link._process_delivery(pn_event.delivery)
 
-            if etype == proton.Event.LINK_FLOW:
-                pn_link = pn_event.link
-                pn_link.context and pn_link.context._process_credit()
-                return True
+        @staticmethod
+        def _on_link_flow(connection, pn_event):
+            link = pn_event.link.context
+            if link:
+                link._credit_changed()
 
-            ep_event = _Link._endpoint_event_map.get(etype)
-            if ep_event is not None:
-                pn_link = pn_event.link
-                pn_link.context and \
-                    pn_link.context._process_endpoint_event(ep_event)
-                return True
+        @staticmethod
+        def _on_endpoint_event(connection, pn_event):
+            link = pn_event.link.context
+            if link:
+                ep_event = _Link._endpoint_event_map[pn_event.type]
+                link._process_endpoint_event(ep_event)
 
-            if etype == proton.Event.LINK_INIT:
-                pn_link = pn_event.link
-                # create a new link if requested by remote:
-                c = hasattr(pn_link, 'context') and pn_link.context
-                if not c:
-                    session = pn_link.session.context
-                    if (pn_link.is_sender and
-                            pn_link.name not in connection._sender_links):
-                        LOG.debug("Remotely initiated Sender needs init")
-                        link = session.request_sender(pn_link)
-                        connection._sender_links[pn_link.name] = link
-                    elif (pn_link.is_receiver and
-                          pn_link.name not in connection._receiver_links):
-                        LOG.debug("Remotely initiated Receiver needs init")
-                        link = session.request_receiver(pn_link)
-                        connection._receiver_links[pn_link.name] = link
-                return True
+        @staticmethod
+        def _on_link_init(connection, pn_event):
+            pn_link = pn_event.link
+            # create a new link if requested by remote:
+            c = hasattr(pn_link, 'context') and pn_link.context
+            if not c:
+                session = pn_link.session.context
+                if (pn_link.is_sender and
+                        pn_link.name not in connection._sender_links):
+                    LOG.debug("Remotely initiated Sender needs init")
+                    link = session.request_sender(pn_link)
+                    connection._sender_links[pn_link.name] = link
+                elif (pn_link.is_receiver and
+                      pn_link.name not in connection._receiver_links):
+                    LOG.debug("Remotely initiated Receiver needs init")
+                    link = session.request_receiver(pn_link)
+                    connection._receiver_links[pn_link.name] = link
 
-            if etype == proton.Event.LINK_FINAL:
-                LOG.debug("link finalized: %s", pn_event.context)
-                return True
+        @staticmethod
+        def _on_link_final(connection, pn_event):
+            LOG.debug("link finalized: %s", pn_event.context)
 
-            return False  # event not handled
+        @staticmethod
+        def _event_handlers():
+            """Map of the proton event types handled by links to the handler
+            for that event.  Handlers are invoked as handler(connection,
+            pn_event).
+            """
+            handlers = dict.fromkeys(_Link._endpoint_event_map,
+                                     _Link._on_endpoint_event)
+            handlers[proton.Event.DELIVERY] = _Link._on_delivery
+            handlers[proton.Event.LINK_FLOW] = _Link._on_link_flow
+            handlers[proton.Event.LINK_INIT] = _Link._on_link_init
+            handlers[proton.Event.LINK_FINAL] = _Link._on_link_final
+            return handlers
 
     elif hasattr(proton.Event, "LINK_REMOTE_STATE"):
         # 0.7 proton event model
         @staticmethod
-        def _handle_proton_event(pn_event, connection):
+        def _handle_proton_event(connection, pn_event):
             if pn_event.type == proton.Event.LINK_REMOTE_STATE:
                 pn_link = pn_event.link
                 # create a new link if requested by remote:
@@ -313,20 +335,24 @@ class _Link(Endpoint):
                         link = session.request_receiver(pn_link)
                         connection._receiver_links[pn_link.name] = link
                 pn_link.context._process_remote_state()
-                return True
             elif pn_event.type == proton.Event.LINK_LOCAL_STATE:
                 pn_link = pn_event.link
                 pn_link.context._process_local_state()
             elif pn_event.type == proton.Event.LINK_FLOW:
                 pn_link = pn_event.link
-                pn_link.context._process_credit()
+                pn_link.context._credit_changed()
             elif pn_event.type == proton.Event.DELIVERY:
                 pn_link = pn_event.link
                 pn_delivery = pn_event.delivery
                 pn_link.context._process_delivery(pn_delivery)
-            else:
-                return False  # unknown
-            return True
+
+        @staticmethod
+        def _event_handlers():
+            return dict.fromkeys([proton.Event.LINK_REMOTE_STATE,
+                                  proton.Event.LINK_LOCAL_STATE,
+                                  proton.Event.LINK_FLOW,
+                                  proton.Event.DELIVERY],
+                                 _Link._handle_proton_event)
 
     # endpoint methods:
     @property
@@ -374,6 +400,9 @@ class SenderEventHandler(object):
 
 
 class SenderLink(_Link):
+    __slots__ = ("_send_requests", "_pending_sends", "_next_deadline",
+                 "_next_tag", "_last_credit", "_sent", "_outcomes",
+                 "_delivery_latency", "_queue_latency")
 
     # Status for message send callback
     #
@@ -385,6 +414,10 @@ class SenderLink(_Link):
     RELEASED = 3
     MODIFIED = 4
 
+    # names of the send outcome counters, indexed by (status - ABORTED)
+    _OUTCOME_NAMES = ("aborted", "timed-out", "unknown", "accepted",
+                      "rejected", "released", "modified")
+
     _DISPOSITION_STATE_MAP = {
         proton.Disposition.ACCEPTED: ACCEPTED,
         proton.Disposition.REJECTED: REJECTED,
@@ -394,6 +427,9 @@ class SenderLink(_Link):
 
     class _SendRequest(object):
         """Tracks sending a single message."""
+        __slots__ = ("link", "tag", "message", "callback", "handle",
+                     "deadline", "timestamp")
+
         def __init__(self, link, tag, message, callback, handle, deadline):
             self.link = link
             self.tag = tag
@@ -401,6 +437,8 @@ class SenderLink(_Link):
             self.callback = callback
             self.handle = handle
             self.deadline = deadline
+            # time queued, then time written (if latency is measured):
+            self.timestamp = link._queue_latency and _clock()
             self.link._send_requests[self.tag] = self
             if self.deadline:
                 self.link._connection._add_timer(self.deadline, self)
@@ -415,9 +453,10 @@ class SenderLink(_Link):
                 self.link._connection._cancel_timer(self.deadline, self)
             if self.tag in self.link._send_requests:
                 del self.link._send_requests[self.tag]
+            self.link._outcomes[state - SenderLink.ABORTED] += 1
             if self.callback:
-                with self.link._callback_lock:
-                    self.callback(self.link, self.handle, state, info)
+                self.link._callback(self.callback, self.link, self.handle,
+                                    state, info)
 
     def __init__(self, connection, pn_link):
         super(SenderLink, self).__init__(connection, pn_link)
@@ -426,9 +465,36 @@ class SenderLink(_Link):
         self._next_deadline = 0
         self._next_tag = 0
         self._last_credit = 0
+        self._sent = 0
+        self._outcomes = [0] * len(SenderLink._OUTCOME_NAMES)
+        self._delivery_latency = None
+        self._queue_latency = None
 
         # TODO(kgiusti) - think about send-settle-mode configuration
 
+    def configure(self, target_address, source_address, handler, properties):
+        super(SenderLink, self).configure(target_address, source_address,
+                                          handler, properties)
+        if properties and properties.get("x-latency-histograms"):
+            self._delivery_latency = LatencyHistogram()
+            self._queue_latency = LatencyHistogram()
+
+    @property
+    def delivery_latency(self):
+        """LatencyHistogram of the time from writing a message to the link
+        until the peer reports its outcome.  None unless the
+        x-latency-histograms link property is set.
+        """
+        return self._delivery_latency
+
+    @property
+    def queue_latency(self):
+        """LatencyHistogram of the time a message waits for credit between
+        send() and being written to the link.  None unless the
+        x-latency-histograms link property is set.
+        """
+        return self._queue_latency
+
     def send(self, message, delivery_callback=None,
              handle=None, deadline=None):
         tag = "pyngus-tag-%s" % self._next_tag
@@ -460,6 +526,20 @@ class SenderLink(_Link):
     def credit(self):
         return self._pn_link.credit
 
+    def stats(self):
+        """Return a map of the link's counters: the number of messages
+        written ("sent"), the count of each send outcome (see the status
+        values), the number of sends not yet completed ("pending"), the
+        number of those waiting for credit ("queued") and the current
+        credit.
+        """
+        stats = dict(zip(SenderLink._OUTCOME_NAMES, self._outcomes))
+        stats["sent"] = self._sent
+        stats["pending"] = len(self._send_requests)
+        stats["queued"] = len(self._pending_sends)
+        stats["credit"] = self._pn_link.credit if self._pn_link else 0
+        return stats
+
     def reject(self, pn_condition=None):
         """See Link Reject, AMQP1.0 spec."""
         self._pn_link.source.type = proton.Terminus.UNSPECIFIED
@@ -491,6 +571,9 @@ class SenderLink(_Link):
                     if annotations:
                         info["message-annotations"] = annotations
                 send_req = self._send_requests.pop(pn_delivery.tag)
+                if self._delivery_latency:
+                    self._delivery_latency.record(_clock() -
+                                                  send_req.timestamp)
                 send_req.destroy(state, info)
                 pn_delivery.settle()
             elif pn_delivery.writable:
@@ -515,14 +598,18 @@ class SenderLink(_Link):
         # Alert if credit has become available
         if self._handler and not self._rejected:
             if 0 < self._pn_link.credit > self._last_credit:
-                with self._callback_lock:
-                    self._handler.credit_granted(self)
+                self._callback(self._handler.credit_granted, self)
         self._last_credit = self._pn_link.credit
 
     def _write_msg(self, pn_delivery, send_req):
         # given a writable delivery, send a message
         self._pn_link.send(send_req.message.encode())
         self._pn_link.advance()
+        self._sent += 1
+        if self._queue_latency:
+            now = _clock()
+            self._queue_latency.record(now - send_req.timestamp)
+            send_req.timestamp = now
         self._last_credit = self._pn_link.credit
         if not send_req.callback:
             # no disposition callback, so we can discard the send request and
@@ -540,23 +627,20 @@ class SenderLink(_Link):
 
     def _link_failed(self, error):
         if self._handler and not self._rejected:
-            with self._callback_lock:
-                self._handler.sender_failed(self, error)
+            self._callback(self._handler.sender_failed, self, error)
 
     # endpoint state machine actions:
 
     def _ep_active(self):
         LOG.debug("SenderLink is up")
         if self._handler and not self._rejected:
-            with self._callback_lock:
-                self._handler.sender_active(self)
+            self._callback(self._handler.sender_active, self)
 
     def _ep_need_close(self):
         LOG.debug("SenderLink remote closed")
         if self._handler and not self._rejected:
             cond = self._pn_link.remote_condition
-            with self._callback_lock:
-                self._handler.sender_remote_closed(self, cond)
+            self._callback(self._handler.sender_remote_closed, self, cond)
 
     def _ep_closed(self):
         LOG.debug("SenderLink close completed")
@@ -568,8 +652,7 @@ class SenderLink(_Link):
             key, send_req = self._send_requests.popitem()
             send_req.destroy(SenderLink.ABORTED, info)
         if self._handler and not self._rejected:
-            with self._callback_lock:
-                self._handler.sender_closed(self)
+            self._callback(self._handler.sender_closed, self)
 
     def _ep_requested(self):
         LOG.debug("Remote has requested a SenderLink")
@@ -594,12 +677,12 @@ class SenderLink(_Link):
             elif (dist_mode == proton.Terminus.DIST_MODE_MOVE):
                 props["distribution-mode"] = "move"
 
-            with self._connection._callback_lock:
-                handler.sender_requested(self._connection,
-                                         pn_link.name,  # handle
-                                         pn_link.name,
-                                         req_source,
-                                         props)
+            self._connection._callback(handler.sender_requested,
+                                       self._connection,
+                                       pn_link.name,  # handle
+                                       pn_link.name,
+                                       req_source,
+                                       props)
 
 
 class ReceiverEventHandler(object):
@@ -621,15 +704,184 @@ class ReceiverEventHandler(object):
     def message_received(self, receiver_link, message, handle):
         LOG.debug("message_received (ignored)")
 
+    def message_chunk(self, receiver_link, handle, data, more):
+        """Streaming links only: part of a delivery has arrived."""
+        LOG.debug("message_chunk (ignored)")
+
+
+try:
+    _HANDLE_TYPES = (int, long)  # noqa: F821
+except NameError:
+    _HANDLE_TYPES = (int,)
+
+
+class _UnsettledDeliveries(object):
+    """Tracks the unsettled deliveries of a ReceiverLink.  Each delivery is
+    assigned an integer handle, which is its arrival sequence number.
+    Deliveries are stored in a list indexed by handle, so lookups are by
+    position and the list stays in arrival order.  Settled entries are
+    replaced by None and trimmed from the head of the list.  Once the list
+    is mostly settled, e.g. behind a delivery the application holds on to,
+    the remaining deliveries are moved to a map so the list can be reset.
+    """
+    __slots__ = ("_items", "_base", "_head", "_count", "_held")
+
+    # compact the list once this many settled slots are at the head:
+    _COMPACT = 1024
+
+    def __init__(self):
+        self._items = []  # pn_delivery or None, handle == _base + index
+        self._base = 0  # handle of _items[0]
+        self._head = 0  # index of the oldest slot that may be unsettled
+        self._count = 0  # unsettled deliveries in _items and _held
+        self._held = {}  # pn_delivery by handle, all handles < _base
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def next_handle(self):
+        """The handle that will be assigned to the next delivery."""
+        return self._base + len(self._items)
+
+    def add(self, pn_delivery):
+        self._items.append(pn_delivery)
+        self._count += 1
+        return self._base + len(self._items) - 1
+
+    def _index(self, handle):
+        if not isinstance(handle, _HANDLE_TYPES):
+            return -1
+        index = handle - self._base
+        if (self._head <= index < len(self._items) and
+                self._items[index] is not None):
+            return index
+        return -1
+
+    def __contains__(self, handle):
+        if self._index(handle) >= 0:
+            return True
+        return (bool(self._held) and isinstance(handle, _HANDLE_TYPES) and
+                handle in self._held)
+
+    def pop(self, handle):
+        """Remove and return the delivery for handle, None if unknown."""
+        index = self._index(handle)
+        if index < 0:
+            if self._held and isinstance(handle, _HANDLE_TYPES):
+                pn_delivery = self._held.pop(handle, None)
+                if pn_delivery is not None:
+                    self._count -= 1
+                return pn_delivery
+            return None
+        pn_delivery = self._items[index]
+        self._items[index] = None
+        self._count -= 1
+        if index == self._head:
+            self._trim()
+        else:
+            self._compact()
+        return pn_delivery
+
+    def _pop_held(self, handle=None):
+        """Remove and return, in arrival order, the held deliveries up to
+        and including handle (all if handle is None).
+        """
+        held = self._held
+        handles = sorted(h for h in held if handle is None or h <= handle)
+        deliveries = [held.pop(h) for h in handles]
+        self._count -= len(deliveries)
+        return deliveries
+
+    def pop_through(self, handle):
+        """Remove and return, in arrival order, the delivery for handle and
+        all unsettled deliveries that arrived before it.
+        """
+        index = self._index(handle)
+        if index < 0:
+            if self._held and handle in self:
+                return self._pop_held(handle)
+            return []
+        deliveries = self._pop_held() if self._held else []
+        items = self._items
+        found = [d for d in items[self._head:index + 1] if d is not None]
+        items[self._head:index + 1] = [None] * (index + 1 - self._head)
+        self._count -= len(found)
+        self._head = index
+        self._trim()
+        return deliveries + found
+
+    def pop_all(self):
+        """Remove and return all deliveries in arrival order."""
+        deliveries = self._pop_held() if self._held else []
+        deliveries.extend(d for d in self._items[self._head:]
+                          if d is not None)
+        self._base += len(self._items)
+        self._items = []
+        self._head = 0
+        self._count = 0
+        return deliveries
+
+    def _trim(self):
+        items = self._items
+        head = self._head
+        end = len(items)
+        while head < end and items[head] is None:
+            head += 1
+        if head == end:
+            self._base += end
+            del items[:]
+            head = 0
+        elif head >= self._COMPACT and head * 2 >= end:
+            self._base += head
+            del items[:head]
+            head = 0
+        self._head = head
+
+    def _compact(self):
+        """Move the unsettled deliveries to _held and reset the list if no
+        more than a quarter of its slots are in use.
+        """
+        items = self._items
+        span = len(items) - self._head
+        if span < self._COMPACT:
+            return
+        live = self._count - len(self._held)
+        if live * 4 > span:
+            return
+        base = self._base
+        held = self._held
+        for index in range(self._head, len(items)):
+            pn_delivery = items[index]
+            if pn_delivery is not None:
+                held[base + index] = pn_delivery
+        self._base += len(items)
+        self._items = []
+        self._head = 0
+
 
 class ReceiverLink(_Link):
+    __slots__ = ("_unsettled_deliveries", "_auto_accept", "_streaming",
+                 "_received")
+
     def __init__(self, connection, pn_link):
         super(ReceiverLink, self).__init__(connection, pn_link)
-        self._next_handle = 0
-        self._unsettled_deliveries = {}  # indexed by handle
+        self._unsettled_deliveries = _UnsettledDeliveries()
+        self._received = 0
+        self._auto_accept = False
+        self._streaming = False
 
         # TODO(kgiusti) - think about receiver-settle-mode configuration
 
+    def configure(self, target_address, source_address, handler, properties):
+        super(ReceiverLink, self).configure(target_address, source_address,
+                                            handler, properties)
+        # accept and settle each message when message_received returns:
+        self._auto_accept = bool(properties and
+                                 properties.get("x-auto-accept"))
+        # pass raw delivery data to message_chunk as it arrives:
+        self._streaming = bool(properties and properties.get("x-streaming"))
+
     @property
     def capacity(self):
         return self._pn_link.credit
@@ -637,8 +889,17 @@ class ReceiverLink(_Link):
     def add_capacity(self, amount):
         self._pn_link.flow(amount)
 
+    def stats(self):
+        """Return a map of the link's counters: the number of messages
+        received, the number of received messages not yet settled
+        ("unsettled") and the current credit.
+        """
+        return {"received": self._received,
+                "unsettled": len(self._unsettled_deliveries),
+                "credit": self._pn_link.credit if self._pn_link else 0}
+
     def _settle_delivery(self, handle, state):
-        pn_delivery = self._unsettled_deliveries.pop(handle, None)
+        pn_delivery = self._unsettled_deliveries.pop(handle)
         if pn_delivery is None:
             raise Exception("Invalid message handle: %s" % str(handle))
         pn_delivery.update(state)
@@ -647,11 +908,41 @@ class ReceiverLink(_Link):
     def message_accepted(self, handle):
         self._settle_delivery(handle, proton.Delivery.ACCEPTED)
 
+    def accept_batch(self, handles):
+        """Accept all the messages identified by handles.  The deliveries
+        are settled in arrival order, which allows the engine to coalesce
+        them into range dispositions.
+        """
+        unsettled = self._unsettled_deliveries
+        handles = set(handles)
+        for handle in handles:
+            if handle not in unsettled:
+                raise Exception("Invalid message handle: %s" % str(handle))
+        if len(handles) == len(unsettled):
+            deliveries = unsettled.pop_all()
+        else:
+            # handles are assigned in arrival order
+            deliveries = [unsettled.pop(handle) for handle in sorted(handles)]
+        for pn_delivery in deliveries:
+            pn_delivery.update(proton.Delivery.ACCEPTED)
+            pn_delivery.settle()
+
+    def accept_through(self, handle):
+        """Accept the message identified by handle along with every unsettled
+        message that arrived before it.
+        """
+        deliveries = self._unsettled_deliveries.pop_through(handle)
+        if not deliveries:
+            raise Exception("Invalid message handle: %s" % str(handle))
+        for pn_delivery in deliveries:
+            pn_delivery.update(proton.Delivery.ACCEPTED)
+            pn_delivery.settle()
+
     def message_released(self, handle):
         self._settle_delivery(handle, proton.Delivery.RELEASED)
 
     def message_rejected(self, handle, pn_condition=None):
-        pn_delivery = self._unsettled_deliveries.pop(handle, None)
+        pn_delivery = self._unsettled_deliveries.pop(handle)
         if pn_delivery is None:
             raise Exception("Invalid message handle: %s" % str(handle))
         if pn_condition:
@@ -661,7 +952,7 @@ class ReceiverLink(_Link):
 
     def message_modified(self, handle, delivery_failed, undeliverable,
                          annotations):
-        pn_delivery = self._unsettled_deliveries.pop(handle, None)
+        pn_delivery = self._unsettled_deliveries.pop(handle)
         if pn_delivery is None:
             raise Exception("Invalid message handle: %s" % str(handle))
         pn_delivery.local.failed = delivery_failed
@@ -684,51 +975,93 @@ class ReceiverLink(_Link):
 
     def _process_delivery(self, pn_delivery):
         """Check if the delivery can be processed."""
-        if pn_delivery.readable and not pn_delivery.partial:
+        if self._streaming:
+            self._stream_delivery(pn_delivery)
+        elif pn_delivery.readable and not pn_delivery.partial:
             data = self._pn_link.recv(pn_delivery.pending)
             msg = proton.Message()
             msg.decode(data)
             self._pn_link.advance()
+            self._received += 1
 
-            if self._handler:
-                handle = "rmsg-%s:%x" % (self._name, self._next_handle)
-                self._next_handle += 1
-                self._unsettled_deliveries[handle] = pn_delivery
-                with self._callback_lock:
-                    self._handler.message_received(self, msg, handle)
+            if self._handler and self._auto_accept:
+                self._callback(self._handler.message_received, self, msg, None)
+                if not pn_delivery.settled:
+                    pn_delivery.update(proton.Delivery.ACCEPTED)
+                pn_delivery.settle()
+            elif self._handler:
+                handle = self._unsettled_deliveries.add(pn_delivery)
+                self._callback(self._handler.message_received, self, msg,
+                               handle)
             else:
                 # TODO(kgiusti): is it ok to assume Delivery.REJECTED?
                 pn_delivery.settle()
 
+    def _stream_delivery(self, pn_delivery):
+        """Drain whatever data has arrived for the delivery and pass it to
+        the handler, without waiting for the rest of the delivery.
+        """
+        if not pn_delivery.readable:
+            return
+        aborted = getattr(pn_delivery, "aborted", False)
+        more = pn_delivery.partial and not aborted
+        data = None
+        if not aborted:
+            data = self._pn_link.recv(pn_delivery.pending) or b""
+            if more and not data:
+                return
+        if not more:
+            self._pn_link.advance()
+            if not aborted:
+                self._received += 1
+
+        if not self._handler:
+            if not more:
+                pn_delivery.settle()
+            return
+
+        unsettled = self._unsettled_deliveries
+        if self._auto_accept:
+            handle = None
+        elif more:
+            handle = unsettled.next_handle
+        else:
+            handle = unsettled.add(pn_delivery)
+            if aborted:
+                unsettled.pop(handle)  # nothing left to settle
+        self._callback(self._handler.message_chunk, self, handle, data, more)
+        if aborted:
+            pn_delivery.settle()
+        elif not more and self._auto_accept:
+            if not pn_delivery.settled:
+                pn_delivery.update(proton.Delivery.ACCEPTED)
+            pn_delivery.settle()
+
     def _process_credit(self):
         # Only used by SenderLink
         pass
 
     def _link_failed(self, error):
         if self._handler and not self._rejected:
-            with self._callback_lock:
-                self._handler.receiver_failed(self, error)
+            self._callback(self._handler.receiver_failed, self, error)
 
     # endpoint state machine actions:
 
     def _ep_active(self):
         LOG.debug("ReceiverLink is up")
         if self._handler and not self._rejected:
-            with self._callback_lock:
-                self._handler.receiver_active(self)
+            self._callback(self._handler.receiver_active, self)
 
     def _ep_need_close(self):
         LOG.debug("ReceiverLink remote closed")
         if self._handler and not self._rejected:
             cond = self._pn_link.remote_condition
-            with self._callback_lock:
-                self._handler.receiver_remote_closed(self, cond)
+            self._callback(self._handler.receiver_remote_closed, self, cond)
 
     def _ep_closed(self):
         LOG.debug("ReceiverLink close completed")
         if self._handler and not self._rejected:
-            with self._callback_lock:
-                self._handler.receiver_closed(self)
+            self._callback(self._handler.receiver_closed, self)
 
     def _ep_requested(self):
         LOG.debug("Remote has initiated a ReceiverLink")
@@ -753,16 +1086,18 @@ class ReceiverLink(_Link):
             elif (dist_mode == proton.Terminus.DIST_MODE_MOVE):
                 props["distribution-mode"] = "move"
 
-            with self._connection._callback_lock:
-                handler.receiver_requested(self._connection,
-                                           pn_link.name,  # handle
-                                           pn_link.name,
-                                           req_target,
-                                           props)
+            self._connection._callback(handler.receiver_requested,
+                                       self._connection,
+                                       pn_link.name,  # handle
+                                       pn_link.name,
+                                       req_target,
+                                       props)
 
 
 class _SessionProxy(Endpoint):
     """Corresponds to a Proton Session object."""
+    __slots__ = ("_locally_initiated", "_connection", "_pn_session", "_links")
+
     def __init__(self, name, connection, pn_session=None):
         super(_SessionProxy, self).__init__(name)
         self._locally_initiated = not pn_session
@@ -772,6 +1107,28 @@ class _SessionProxy(Endpoint):
         self._pn_session = pn_session
         self._links = set()
         pn_session.context = self
+        if connection._session_capacity:
+            pn_session.incoming_capacity = connection._session_capacity
+        if connection._session_window:
+            pn_session.outgoing_window = connection._session_window
+
+    @property
+    def incoming_capacity(self):
+        """Bytes of incoming data the session may buffer."""
+        return self._pn_session.incoming_capacity
+
+    @incoming_capacity.setter
+    def incoming_capacity(self, capacity):
+        self._pn_session.incoming_capacity = capacity
+
+    @property
+    def outgoing_window(self):
+        """Outgoing window of the session, in frames."""
+        return self._pn_session.outgoing_window
+
+    @outgoing_window.setter
+    def outgoing_window(self, window):
+        self._pn_session.outgoing_window = window
 
     def open(self):
         if self._pn_session.state & proton.Endpoint.LOCAL_UNINIT:
@@ -819,29 +1176,44 @@ class _SessionProxy(Endpoint):
             proton.Event.SESSION_LOCAL_CLOSE: Endpoint.LOCAL_CLOSED}
 
         @staticmethod
-        def _handle_proton_event(pn_event, connection):
-            ep_event = _SessionProxy._endpoint_event_map.get(pn_event.type)
-            if ep_event is not None:
-                pn_session = pn_event.context
-                pn_session.context._process_endpoint_event(ep_event)
-            elif pn_event.type == proton.Event.SESSION_INIT:
-                # create a new session if requested by remote:
-                pn_session = pn_event.context
-                c = hasattr(pn_session, 'context') and pn_session.context
-                if not c:
-                    LOG.debug("Opening remotely initiated session")
-                    name = "session-%d" % connection._remote_session_id
-                    connection._remote_session_id += 1
-                    _SessionProxy(name, connection, pn_session)
-            elif pn_event.type == proton.Event.SESSION_FINAL:
-                LOG.debug("Session finalized: %s", pn_event.context)
-            else:
-                return False  # unknown
-            return True  # handled
+        def _on_endpoint_event(connection, pn_event):
+            ep_event = _SessionProxy._endpoint_event_map[pn_event.type]
+            pn_session = pn_event.context
+            pn_session.context._process_endpoint_event(ep_event)
+
+        @staticmethod
+        def _on_session_init(connection, pn_event):
+            # create a new session if requested by remote:
+            pn_session = pn_event.context
+            c = hasattr(pn_session, 'context') and pn_session.context
+            if not c:
+                LOG.debug("Opening remotely initiated session")
+                name = "session-%d" % connection._remote_session_id
+                connection._remote_session_id += 1
+                _SessionProxy(name, connection, pn_session)
+
+        @staticmethod
+        def _on_session_final(connection, pn_event):
+            LOG.debug("Session finalized: %s", pn_event.context)
+
+        @staticmethod
+        def _event_handlers():
+            """Map of the proton event types handled by sessions to the
+            handler for that event.  Handlers are invoked as
+            handler(connection, pn_event).
+            """
+            handlers = dict.fromkeys(_SessionProxy._endpoint_event_map,
+                                     _SessionProxy._on_endpoint_event)
+            handlers[proton.Event.SESSION_INIT] = \
+                _SessionProxy._on_session_init
+            handlers[proton.Event.SESSION_FINAL] = \
+                _SessionProxy._on_session_final
+            return handlers
+
     elif hasattr(proton.Event, "SESSION_REMOTE_STATE"):
         # 0.7 proton event model
         @staticmethod
-        def _handle_proton_event(pn_event, connection):
+        def _handle_proton_event(connection, pn_event):
             if pn_event.type == proton.Event.SESSION_REMOTE_STATE:
                 pn_session = pn_event.session
                 # create a new session if requested by remote:
@@ -855,9 +1227,12 @@ class _SessionProxy(Endpoint):
             elif pn_event.type == proton.Event.SESSION_LOCAL_STATE:
                 pn_session = pn_event.session
                 pn_session.context._process_local_state()
-            else:
-                return False  # unknown
-            return True  # handled
+
+        @staticmethod
+        def _event_handlers():
+            return dict.fromkeys([proton.Event.SESSION_REMOTE_STATE,
+                                  proton.Event.SESSION_LOCAL_STATE],
+                                 _SessionProxy._handle_proton_event)
 
     @property
     def _endpoint_state(self):
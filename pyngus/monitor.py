@@ -0,0 +1,160 @@
+#    Licensed to the Apache Software Foundation (ASF) under one
+#    or more contributor license agreements.  See the NOTICE file
+#    distributed with this work for additional information
+#    regarding copyright ownership.  The ASF licenses this file
+#    to you under the Apache License, Version 2.0 (the
+#    "License"); you may not use this file except in compliance
+#    with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an
+#    "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#    KIND, either express or implied.  See the License for the
+#    specific language governing permissions and limitations
+#    under the License.
+__all__ = [
+    "CallbackProfiler",
+    "LoopMonitor"
+]
+
+import logging
+import time
+
+from pyngus.histogram import LatencyHistogram
+
+LOG = logging.getLogger(__name__)
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+def _callback_name(method):
+    """Identify a callback by the class and name of the method."""
+    owner = getattr(method, "__self__", None)
+    if owner is not None:
+        return "%s.%s" % (type(owner).__name__, method.__name__)
+    name = getattr(method, "__name__", None)
+    if name is not None:
+        return "%s.%s" % (getattr(method, "__module__", None), name)
+    return "%s.__call__" % type(method).__name__
+
+
+class CallbackProfiler(object):
+    """Times the application callbacks made by Connections and their links.
+
+    Pass an instance as the x-callback-profiler property of one or more
+    Connections.  Timings are aggregated by handler class and method.
+    Callbacks that take longer than threshold seconds are counted as slow
+    and reported by calling slow_callback().
+    """
+    def __init__(self, threshold=None):
+        self.threshold = threshold
+        self._stats = {}  # indexed by callback name
+
+    def stats(self):
+        """Return a map of the timings, indexed by "Class.method".  Each
+        value is a map with the number of "calls", the "total", "max" and
+        "mean" time in seconds, and the number of "slow" calls.
+        """
+        result = {}
+        for name, (calls, total, longest, slow) in self._stats.items():
+            result[name] = {"calls": calls,
+                            "total": total,
+                            "max": longest,
+                            "mean": total / calls,
+                            "slow": slow}
+        return result
+
+    def reset(self):
+        """Discard all timings."""
+        self._stats = {}
+
+    def slow_callback(self, connection, name, elapsed):
+        """Called after a callback took longer than the threshold.  Logs a
+        warning by default.
+        """
+        LOG.warning("Connection %s: callback %s took %.6f seconds",
+                    connection.name, name, elapsed)
+
+    def _call(self, connection, method, args):
+        start = _clock()
+        try:
+            return method(*args)
+        finally:
+            elapsed = _clock() - start
+            name = _callback_name(method)
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = [0, 0.0, 0.0, 0]
+                self._stats[name] = stats
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+            if self.threshold is not None and elapsed > self.threshold:
+                stats[3] += 1
+                self.slow_callback(connection, name, elapsed)
+
+
+class LoopMonitor(object):
+    """Times the phases of the I/O loop that drives one or more Connections.
+
+    Pass an instance as the x-loop-monitor property of each Connection.
+    The time taken by each call to read_socket_input() and
+    write_socket_output() is recorded in the read and write histograms.
+    Calls to Connection.process() made on or after the Connection's
+    deadline are recorded in the timer histogram, and how late they were
+    is recorded in the lag histogram.  All other calls to process() are
+    recorded in the process histogram.  Loops that do not use the socket
+    helpers may record their own I/O times in the read and write
+    histograms.
+
+    If lag_threshold is given, timers that fire more than lag_threshold
+    seconds late are reported by calling timer_late().
+    """
+    PHASES = ("read", "process", "timer", "write", "lag")
+
+    def __init__(self, lag_threshold=None):
+        self.lag_threshold = lag_threshold
+        self.read = LatencyHistogram()
+        self.process = LatencyHistogram()
+        self.timer = LatencyHistogram()
+        self.write = LatencyHistogram()
+        self.lag = LatencyHistogram()
+
+    def stats(self):
+        """Return a map of the LatencyHistogram of each phase, indexed by
+        "read", "process", "timer", "write" and "lag".
+        """
+        return dict((phase, getattr(self, phase)) for phase in self.PHASES)
+
+    def reset(self):
+        """Discard all timings."""
+        for phase in self.PHASES:
+            getattr(self, phase).reset()
+
+    def timer_late(self, connection, lag):
+        """Called when process() was called more than lag_threshold seconds
+        after the Connection's deadline.  Logs a warning by default.
+        """
+        LOG.warning("Connection %s: timers processed %.6f seconds late",
+                    connection.name, lag)
+
+    def _process(self, connection, now, max_events, max_time):
+        deadline = connection._next_deadline
+        late = (deadline and now >= deadline and
+                not connection._work_pending)
+        start = _clock()
+        try:
+            return connection._process(now, max_events, max_time)
+        finally:
+            elapsed = _clock() - start
+            if late:
+                self.timer.record(elapsed)
+                lag = now - deadline
+                self.lag.record(lag)
+                if self.lag_threshold is not None and lag > self.lag_threshold:
+                    self.timer_late(connection, lag)
+            else:
+                self.process.record(elapsed)
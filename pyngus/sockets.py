@@ -28,6 +28,7 @@ import logging
 import socket
 
 from pyngus.connection import Connection
+from pyngus.monitor import _clock
 
 LOG = logging.getLogger(__name__)
 
@@ -38,6 +39,17 @@ def read_socket_input(connection, socket_obj):
     Returns the number of input bytes processed, or EOS if input processing
     is done.  Any exceptions raised by the socket are re-raised.
     """
+    monitor = connection._loop_monitor
+    if monitor is None:
+        return _read_socket_input(connection, socket_obj)
+    start = _clock()
+    try:
+        return _read_socket_input(connection, socket_obj)
+    finally:
+        monitor.read.record(_clock() - start)
+
+
+def _read_socket_input(connection, socket_obj):
     count = connection.needs_input
     if count <= 0:
         return count  # 0 or EOS
@@ -79,6 +91,17 @@ def write_socket_output(connection, socket_obj):
     Returns the number of output bytes sent, or EOS if output processing
     is done.  Any exceptions raised by the socket are re-raised.
     """
+    monitor = connection._loop_monitor
+    if monitor is None:
+        return _write_socket_output(connection, socket_obj)
+    start = _clock()
+    try:
+        return _write_socket_output(connection, socket_obj)
+    finally:
+        monitor.write.record(_clock() - start)
+
+
+def _write_socket_output(connection, socket_obj):
     count = connection.has_output
     if count <= 0:
         return count  # 0 or EOS
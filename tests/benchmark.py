@@ -0,0 +1,675 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Benchmark suite for pyngus.
+
+Each benchmark is run over a matrix of parameters using a pair of
+Connections joined in memory (no network), and the results are written as
+JSON.  Two result files can be compared to flag regressions:
+
+  benchmark.py run --output new.json
+  benchmark.py compare baseline.json new.json
+"""
+
+import gc
+import itertools
+import json
+import optparse
+import os
+import platform
+import sys
+import time
+import uuid
+
+from proton import Message
+from proton import SSL
+from proton import VERSION as PN_VERSION
+import pyngus
+
+_clock = getattr(time, "perf_counter", time.time)
+_cpu_clock = getattr(time, "process_time", None) or time.clock
+
+RESULTS_VERSION = 1
+
+# whether a larger value of a metric is better or worse:
+HIGHER = "higher"
+LOWER = "lower"
+METRICS = {
+    "msgs-per-sec": HIGHER,
+    "mb-per-sec": HIGHER,
+    "latency-p50-ms": LOWER,
+    "latency-p99-ms": LOWER,
+    "latency-p999-ms": LOWER,
+    "bytes-per-connection": LOWER,
+    "bytes-per-link": LOWER,
+    "connections-per-sec": HIGHER,
+    "loop-usec": LOWER,
+    "need-processing-usec": LOWER,
+    "cpu-usec-per-msg": LOWER,
+    "rss-per-connection": LOWER,
+    "handshakes-per-sec": HIGHER,
+    "setup-p50-ms": LOWER,
+    "setup-p99-ms": LOWER,
+}
+
+# name -> (function, full parameter matrix, quick parameter matrix)
+BENCHMARKS = {}
+
+
+def benchmark(name, matrix, quick=None):
+    """Register a benchmark function.  The function is called with one
+    keyword argument per parameter and returns a map of metrics.
+    """
+    def _register(func):
+        BENCHMARKS[name] = (func, matrix, quick or matrix)
+        return func
+    return _register
+
+
+def _expand(matrix):
+    """Yield every combination of the parameters in matrix."""
+    names = sorted(matrix)
+    for values in itertools.product(*[matrix[n] for n in names]):
+        yield dict(zip(names, values))
+
+
+# In-memory transport between two Connections:
+
+def _do_io(src, dst):
+    count = min(src.has_output, dst.needs_input)
+    if count > 0:
+        count = dst.process_input(src.output_data())
+        if count > 0:
+            src.output_written(count)
+            return True
+    return False
+
+
+def _run_until(c1, c2, done, timeout=600.0):
+    """Transfer data and process both Connections until done() is True."""
+    deadline = time.time() + timeout
+    while not done():
+        io = _do_io(c1, c2)
+        io = _do_io(c2, c1) or io
+        now = time.time()
+        c1.process(now)
+        c2.process(now)
+        if not io and not done() and now > deadline:
+            raise Exception("Benchmark stalled")
+
+
+def _connect(container, c1_handler=None, c2_handler=None,
+             c1_props=None, c2_props=None):
+    """Create and open a client/server pair of Connections.  The server
+    properties may be a ConnectionConfig created with "x-server".
+    """
+    if isinstance(c2_props, pyngus.ConnectionConfig):
+        props = c2_props
+    else:
+        props = {"x-server": True}
+        props.update(c2_props or {})
+    c1 = container.create_connection("c1-" + uuid.uuid4().hex, c1_handler,
+                                     c1_props)
+    c2 = container.create_connection("c2-" + uuid.uuid4().hex, c2_handler,
+                                     props)
+    c1.open()
+    c2.open()
+    _run_until(c1, c2, lambda: c1.active and c2.active)
+    return c1, c2
+
+
+def _latency_metrics(histogram):
+    return {"latency-p50-ms": histogram.percentile(50) * 1000.0,
+            "latency-p99-ms": histogram.percentile(99) * 1000.0,
+            "latency-p999-ms": histogram.percentile(99.9) * 1000.0}
+
+
+# Throughput and latency:
+
+class _Receiver(pyngus.ConnectionEventHandler, pyngus.ReceiverEventHandler):
+    """Accepts every link and message, recording the message latency."""
+    def __init__(self, credit, settled):
+        self.credit = credit
+        self.settled = settled
+        self.received = 0
+        self.links = []
+        self.histogram = pyngus.LatencyHistogram()
+
+    def receiver_requested(self, connection, link_handle,
+                           name, requested_target, properties):
+        link = connection.accept_receiver(link_handle,
+                                          requested_target or name,
+                                          event_handler=self)
+        link.add_capacity(self.credit)
+        link.open()
+        self.links.append(link)
+
+    def message_received(self, receiver_link, message, handle):
+        self.histogram.record(time.time() - message.creation_time)
+        self.received += 1
+        if not self.settled:
+            receiver_link.message_accepted(handle)
+        if receiver_link.capacity <= self.credit // 2:
+            receiver_link.add_capacity(self.credit - receiver_link.capacity)
+
+
+class _Sender(pyngus.SenderEventHandler):
+    """Sends count messages as fast as credit allows."""
+    def __init__(self, connection, index, count, size, settled, deadline):
+        self.count = count
+        self.sent = 0
+        self.acked = 0
+        self.settled = settled
+        self.deadline = deadline
+        self.message = Message(body=b"x" * size)
+        props = {"snd-settle-mode": "settled"} if settled else None
+        self.link = connection.create_sender("bench-%d" % index,
+                                             event_handler=self,
+                                             properties=props)
+        self.link.open()
+
+    def sender_active(self, sender_link):
+        self._send()
+
+    def credit_granted(self, sender_link):
+        self._send()
+
+    def _send(self):
+        callback = None if self.settled else self._send_complete
+        while self.link.credit > 0 and self.sent < self.count:
+            now = time.time()
+            self.message.creation_time = now
+            deadline = now + self.deadline if self.deadline else None
+            self.link.send(self.message, callback, deadline=deadline)
+            self.sent += 1
+
+    def _send_complete(self, link, handle, status, info):
+        self.acked += 1
+
+
+def _throughput(links, credit, size, settle, messages, deadline=None,
+                c1_props=None, c2_props=None):
+    container = pyngus.Container("benchmark")
+    settled = settle == "settled"
+    receiver = _Receiver(credit, settled)
+    c1, c2 = _connect(container, c2_handler=receiver,
+                      c1_props=c1_props, c2_props=c2_props)
+    per_link = max(1, messages // links)
+    total = per_link * links
+    start = _clock()
+    senders = [_Sender(c1, i, per_link, size, settled, deadline)
+               for i in range(links)]
+    if settled:
+        def done():
+            return receiver.received == total
+    else:
+        def done():
+            return sum(s.acked for s in senders) == total
+    _run_until(c1, c2, done)
+    elapsed = _clock() - start
+    for link in [s.link for s in senders] + receiver.links:
+        link.destroy()
+    c1.destroy()
+    c2.destroy()
+    container.destroy()
+    metrics = {"msgs-per-sec": total / elapsed,
+               "mb-per-sec": total * size / elapsed / 1.0e6}
+    metrics.update(_latency_metrics(receiver.histogram))
+    return metrics
+
+
+@benchmark("throughput",
+           {"links": [1, 10], "credit": [10, 100],
+            "size": [16, 1024, 16384], "settle": ["settled", "unsettled"],
+            "messages": [10000]},
+           {"links": [1, 10], "credit": [100], "size": [16, 1024],
+            "settle": ["settled", "unsettled"], "messages": [2000]})
+def throughput(links, credit, size, settle, messages):
+    """Messages/second and latency for the given link count, credit
+    window, message size and settle mode.
+    """
+    return _throughput(links, credit, size, settle, messages)
+
+
+@benchmark("timers",
+           {"links": [1, 10], "messages": [10000]},
+           {"links": [10], "messages": [2000]})
+def timers(links, messages):
+    """Throughput when every send has a deadline, i.e. a timer per send.
+    """
+    return _throughput(links, 100, 16, "unsettled", messages, deadline=60.0)
+
+
+# Memory:
+
+@benchmark("memory", {"count": [500]}, {"count": [200]})
+def memory(count):
+    """Bytes allocated per open Connection pair and per link pair."""
+    try:
+        import tracemalloc
+    except ImportError:
+        return {}
+    container = pyngus.Container("benchmark")
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        pairs = [_connect(container) for i in range(count)]
+        conn_size = tracemalloc.get_traced_memory()[0] - start
+        start = tracemalloc.get_traced_memory()[0]
+        links = []
+        for c1, c2 in pairs:
+            links.append(c1.create_sender("src"))
+            links.append(c1.create_receiver("tgt"))
+            for link in links[-2:]:
+                link.open()
+        link_size = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    for link in links:
+        link.destroy()
+    for c1, c2 in pairs:
+        c1.destroy()
+        c2.destroy()
+    container.destroy()
+    return {"bytes-per-connection": conn_size / (2.0 * count),
+            "bytes-per-link": link_size / float(len(links))}
+
+
+# Connection churn:
+
+@benchmark("churn",
+           {"links": [0, 1], "sasl": ["none", "anonymous"], "count": [1000]},
+           {"links": [0, 1], "sasl": ["none", "anonymous"], "count": [200]})
+def churn(links, sasl, count):
+    """Connection pairs created, opened (with SASL ANONYMOUS
+    authentication if sasl is "anonymous"), closed and destroyed per
+    second.
+    """
+    container = pyngus.Container("benchmark")
+    handler = _Receiver(10, True)
+    props = {"x-sasl-mechs": "ANONYMOUS"} if sasl == "anonymous" else None
+    start = _clock()
+    for i in range(count):
+        handler.links = []
+        c1, c2 = _connect(container, c2_handler=handler,
+                          c1_props=props, c2_props=props)
+        senders = [c1.create_sender("churn-%d" % j) for j in range(links)]
+        for link in senders:
+            link.open()
+        if links:
+            _run_until(c1, c2, lambda: len(handler.links) == links and
+                       all(link.active for link in senders))
+        c1.close()
+        c2.close()
+        _run_until(c1, c2, lambda: c1.closed and c2.closed)
+        for link in senders + handler.links:
+            link.destroy()
+        c1.destroy()
+        c2.destroy()
+    elapsed = _clock() - start
+    container.destroy()
+    return {"connections-per-sec": count / elapsed}
+
+
+# Scaling with the number of Connections:
+
+def _rss():
+    """Resident memory of this process in bytes, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _loop(container, peers, now):
+    """One iteration of an I/O loop driven by Container.need_processing().
+    Data is transferred in memory from each writer to its peer.
+    """
+    readers, writers, timers = container.need_processing()
+    worked = set()
+    for conn in writers:
+        peer = peers[conn]
+        if _do_io(conn, peer):
+            worked.add(conn)
+            worked.add(peer)
+    for conn in timers:
+        if conn.deadline > now:
+            break
+        worked.add(conn)
+    for conn in worked:
+        conn.process(now)
+
+
+@benchmark("scaling",
+           {"connections": [10, 100, 1000, 10000, 50000],
+            "active": [0.01, 0.1, 1.0], "iterations": [100]},
+           {"connections": [10, 100, 1000], "active": [0.1],
+            "iterations": [50]})
+def scaling(connections, active, iterations):
+    """Cost of an I/O loop iteration over a Container with the given number
+    of Connection pairs, of which a fraction have a link sending one
+    message per iteration.  All Connections have an idle timeout, so each
+    has a pending timer.
+    """
+    container = pyngus.Container("benchmark")
+    receiver = _Receiver(10, True)
+    props = {"idle-time-out": 60}
+    server_props = {"idle-time-out": 60, "x-server": True}
+    gc.collect()
+    rss = _rss()
+    peers = {}
+    senders = []
+    active_count = max(1, int(connections * active))
+    for i in range(connections):
+        c1 = container.create_connection("c1-%d" % i, None, props)
+        c2 = container.create_connection("c2-%d" % i, receiver,
+                                         server_props)
+        peers[c1] = c2
+        peers[c2] = c1
+        c1.open()
+        c2.open()
+        if i < active_count:
+            link = c1.create_sender("scale-%d" % i,
+                                    properties={"snd-settle-mode":
+                                                "settled"})
+            link.open()
+            senders.append(link)
+    while not (all(c.active for c in peers) and
+               len(receiver.links) == active_count and
+               all(link.credit for link in senders)):
+        _loop(container, peers, time.time())
+    gc.collect()
+    if rss is not None:
+        rss = (_rss() - rss) / float(len(peers))
+
+    message = Message(body=b"x" * 16)
+    loop_time = 0.0
+    need_time = 0.0
+    need_cpu = 0.0
+    cpu_start = _cpu_clock()
+    for i in range(iterations):
+        start = _clock()
+        for link in senders:
+            if link.credit > 0:
+                link.send(message)
+        _loop(container, peers, time.time())
+        loop_time += _clock() - start
+        start = _clock()
+        cpu = _cpu_clock()
+        container.need_processing()
+        need_cpu += _cpu_clock() - cpu
+        need_time += _clock() - start
+    # CPU time of the message traffic, without need_processing():
+    cpu_time = _cpu_clock() - cpu_start - need_cpu
+    received = receiver.received
+
+    for link in senders + receiver.links:
+        link.destroy()
+    for conn in peers:
+        conn.destroy()
+    container.destroy()
+    metrics = {"loop-usec": loop_time * 1.0e6 / iterations,
+               "need-processing-usec": need_time * 1.0e6 / iterations,
+               "cpu-usec-per-msg": cpu_time * 1.0e6 / max(1, received)}
+    if rss is not None:
+        metrics["rss-per-connection"] = rss
+    return metrics
+
+
+# TLS:
+
+_SSL_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "unit_tests", "ssl_db")
+
+
+def _security_props(security, sasl="none"):
+    """Return the client and server properties for the security mode:
+    "plain", "tls" (server authenticated) or "mutual-tls", with SASL
+    ANONYMOUS authentication if sasl is "anonymous".
+    """
+    def _path(name):
+        return os.path.join(_SSL_DB, name)
+
+    client = {}
+    server = {}
+    if security in ("tls", "mutual-tls"):
+        server.update({"x-ssl-server": True,
+                       "x-ssl-identity": (_path("server-certificate.pem"),
+                                          _path("server-private-key.pem"),
+                                          "server-password")})
+        client.update({"x-ssl-ca-file": _path("ca-certificate.pem"),
+                       "x-ssl-verify-mode": "verify-peer",
+                       "x-ssl-peer-name": "some.server.com"})
+    if security == "mutual-tls":
+        server.update({"x-ssl-ca-file": _path("ca-certificate.pem"),
+                       "x-ssl-verify-mode": "verify-peer",
+                       "x-ssl-peer-name": "my.client.com"})
+        client["x-ssl-identity"] = (_path("client-certificate.pem"),
+                                    _path("client-private-key.pem"),
+                                    "client-password")
+    if sasl == "anonymous":
+        client["x-sasl-mechs"] = "ANONYMOUS"
+        server["x-sasl-mechs"] = "ANONYMOUS"
+    return client, server
+
+
+@benchmark("tls-throughput",
+           {"security": ["plain", "tls"], "size": [16, 1024, 16384],
+            "messages": [10000]},
+           {"security": ["plain", "tls"], "size": [1024],
+            "messages": [2000]})
+def tls_throughput(security, size, messages):
+    """Steady state throughput and latency over TLS and plaintext."""
+    if security != "plain" and not SSL.present():
+        return {}
+    client, server = _security_props(security)
+    return _throughput(1, 100, size, "unsettled", messages,
+                       c1_props=client, c2_props=server)
+
+
+@benchmark("tls-handshake",
+           {"security": ["plain", "tls", "mutual-tls"],
+            "sasl": ["none", "anonymous"],
+            "setup": ["uncached", "map", "config", "resume"],
+            "count": [500]},
+           {"security": ["plain", "tls"], "sasl": ["anonymous"],
+            "setup": ["uncached", "map", "config", "resume"],
+            "count": [100]})
+def tls_handshake(security, sasl, setup, count):
+    """Connection setup rate: the time from creating a Connection pair
+    until both are active, including the TLS and SASL handshakes.  The
+    Connections are created from a properties map with the SSL domain
+    cache cleared before each pair ("uncached"), from a properties map
+    ("map"), from a shared ConnectionConfig ("config"), or from a shared
+    ConnectionConfig that resumes the client's SSL session ("resume").
+    """
+    if security != "plain" and not SSL.present():
+        return {}
+    client, server = _security_props(security, sasl)
+    if setup == "resume" and security != "plain":
+        client["x-ssl-session-id"] = True
+    if setup in ("config", "resume"):
+        server["x-server"] = True
+        client = pyngus.ConnectionConfig(client)
+        server = pyngus.ConnectionConfig(server)
+    pyngus.clear_ssl_domains()
+    container = pyngus.Container("benchmark")
+    histogram = pyngus.LatencyHistogram()
+    elapsed = 0.0
+    for i in range(count):
+        if setup == "uncached":
+            pyngus.clear_ssl_domains()
+        start = _clock()
+        c1, c2 = _connect(container, c1_props=client, c2_props=server)
+        delay = _clock() - start
+        elapsed += delay
+        histogram.record(delay)
+        # a clean close lets the client's SSL session be resumed:
+        c1.close()
+        c2.close()
+        _run_until(c1, c2, lambda: c1.closed and c2.closed)
+        c1.destroy()
+        c2.destroy()
+    container.destroy()
+    return {"handshakes-per-sec": count / elapsed,
+            "setup-p50-ms": histogram.percentile(50) * 1000.0,
+            "setup-p99-ms": histogram.percentile(99) * 1000.0}
+
+
+# Running and comparing:
+
+def _environment():
+    return {"pyngus": ".".join(map(str, pyngus.VERSION)),
+            "proton": ".".join(map(str, PN_VERSION)),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+def _key(result):
+    return (result["benchmark"],
+            json.dumps(result["params"], sort_keys=True))
+
+
+def _format_params(params):
+    return " ".join("%s=%s" % (k, params[k]) for k in sorted(params))
+
+
+def run(names, quick, repeat):
+    """Run the named benchmarks and return the results.  Each metric is the
+    median of repeat runs.
+    """
+    results = []
+    for name in names:
+        func, matrix, quick_matrix = BENCHMARKS[name]
+        for params in _expand(quick_matrix if quick else matrix):
+            samples = [func(**params) for i in range(repeat)]
+            metrics = dict((m, _median([s[m] for s in samples]))
+                           for m in samples[0])
+            results.append({"benchmark": name,
+                            "params": params,
+                            "metrics": metrics})
+            print("%-14s %-50s %s" % (name, _format_params(params),
+                                      " ".join("%s=%.1f" % (m, metrics[m])
+                                               for m in sorted(metrics))))
+            sys.stdout.flush()
+    return {"version": RESULTS_VERSION,
+            "environment": _environment(),
+            "results": results}
+
+
+def compare(baseline, current, threshold):
+    """Compare the metrics of current against baseline.  Returns a list of
+    (benchmark, params, metric, old, new, change%) for every metric that
+    is worse by more than threshold percent.
+    """
+    old = dict((_key(r), r) for r in baseline["results"])
+    regressions = []
+    for result in current["results"]:
+        base = old.get(_key(result))
+        if base is None:
+            print("%-14s %-50s (no baseline)"
+                  % (result["benchmark"], _format_params(result["params"])))
+            continue
+        for metric in sorted(result["metrics"]):
+            new_value = result["metrics"][metric]
+            old_value = base["metrics"].get(metric)
+            if not old_value:
+                continue
+            change = (new_value - old_value) * 100.0 / old_value
+            worse = change if METRICS.get(metric) == LOWER else -change
+            flag = ""
+            if worse > threshold:
+                flag = "REGRESSION"
+                regressions.append((result["benchmark"], result["params"],
+                                    metric, old_value, new_value, change))
+            elif -worse > threshold:
+                flag = "improved"
+            print("%-14s %-50s %-20s %12.2f %12.2f %+7.1f%% %s"
+                  % (result["benchmark"], _format_params(result["params"]),
+                     metric, old_value, new_value, change, flag))
+    return regressions
+
+
+def main(argv=None):
+    _usage = """Usage: %prog [options] run
+       %prog [options] compare BASELINE RESULTS"""
+    parser = optparse.OptionParser(usage=_usage)
+    parser.add_option("--output", "-o",
+                      help="Write the results to this JSON file.")
+    parser.add_option("--benchmark", "-b", action="append",
+                      help="Benchmark to run (may be repeated).  Available:"
+                      " %s" % ", ".join(sorted(BENCHMARKS)))
+    parser.add_option("--quick", action="store_true",
+                      help="Run a reduced parameter matrix.")
+    parser.add_option("--repeat", type="int", default=1,
+                      help="Report the median of N runs of each benchmark.")
+    parser.add_option("--baseline",
+                      help="Compare the results of run with this file.")
+    parser.add_option("--threshold", type="float", default=10.0,
+                      help="Percent change that is flagged as a regression"
+                      " (default 10).")
+    opts, extra = parser.parse_args(args=argv)
+    command = extra[0] if extra else "run"
+
+    if command == "compare":
+        if len(extra) != 3:
+            parser.error("compare requires BASELINE and RESULTS files")
+        with open(extra[1]) as f:
+            baseline = json.load(f)
+        with open(extra[2]) as f:
+            current = json.load(f)
+    elif command == "run":
+        names = opts.benchmark or sorted(BENCHMARKS)
+        for name in names:
+            if name not in BENCHMARKS:
+                parser.error("Unknown benchmark: %s" % name)
+        current = run(names, opts.quick, opts.repeat)
+        if opts.output:
+            with open(opts.output, "w") as f:
+                json.dump(current, f, indent=2, sort_keys=True)
+        if not opts.baseline:
+            return 0
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+    else:
+        parser.error("Unknown command: %s" % command)
+
+    regressions = compare(baseline, current, opts.threshold)
+    if regressions:
+        print("%d regression(s) over %.1f%%"
+              % (len(regressions), opts.threshold))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
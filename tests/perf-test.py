@@ -34,7 +34,7 @@ class PerfConnection(pyngus.ConnectionEventHandler):
         self.name = name
         self.connection = container.create_connection(name, self,
                                                       properties)
-        self.connection.context = self
+        self.connection.user_context = self
 
     def connection_failed(self, connection, error):
         """Connection's transport has failed in some way."""
@@ -64,6 +64,7 @@ class PerfReceiveConnection(PerfConnection):
         self.latency = 0
         self.latency_min = 100000000
         self.latency_max = 0
+        self.histogram = pyngus.LatencyHistogram()
         self.connection.open()
         self.receivers = set()
 
@@ -95,7 +96,7 @@ class PerfSender(pyngus.SenderEventHandler):
         self.perf_conn.senders.add(self)
         connection = perf_send_conn.connection
         self.link = connection.create_sender(address, event_handler=self)
-        self.link.context = self
+        self.link.user_context = self
         self.link.open()
 
     def sender_active(self, sender_link):
@@ -135,7 +136,7 @@ class PerfReceiver(pyngus.ReceiverEventHandler):
         self.link = connection.accept_receiver(handle,
                                                target_override=address,
                                                event_handler=self)
-        self.link.context = self
+        self.link.user_context = self
         self.link.add_capacity(self.credit_window)
         self.link.open()
 
@@ -148,6 +149,7 @@ class PerfReceiver(pyngus.ReceiverEventHandler):
         self.perf_conn.latency += latency
         self.perf_conn.latency_min = min(latency, self.perf_conn.latency_min)
         self.perf_conn.latency_max = max(latency, self.perf_conn.latency_max)
+        self.perf_conn.histogram.record(latency)
         if self.link.capacity <= self.credit_low and \
            self.received < self.msg_count:
             self.link.add_capacity(self.credit_window - self.link.capacity)
@@ -188,6 +190,14 @@ def main(argv=None):
     parser.add_option("--credit", dest="credit_window", type="int",
                       default=10,
                       help="Credit window issued by receiver.")
+    parser.add_option("--trace-buffer", dest="trace_buffer", type="int",
+                      help="Keep the last N frames in a trace buffer.")
+    parser.add_option("--trace-sample", dest="trace_sample", type="int",
+                      default=1,
+                      help="Keep one in N frames in the trace buffer.")
+    parser.add_option("--capture", dest="capture",
+                      help="Record the receiver's traffic to this file"
+                      " (see replay-capture.py).")
     parser.add_option("--ca",
                       help="Certificate Authority PEM file")
     parser.add_option("--cert",
@@ -205,6 +215,9 @@ def main(argv=None):
     conn_properties = {'hostname': "test.server.com",
                        'x-trace-protocol': False,
                        'x-sasl-mechs': "ANONYMOUS"}
+    if opts.trace_buffer:
+        conn_properties["x-trace-buffer"] = opts.trace_buffer
+        conn_properties["x-trace-sample"] = opts.trace_sample
     if opts.ca:
         conn_properties["x-ssl-ca-file"] = opts.ca
     sender_conn = PerfSendConnection("send-conn",
@@ -220,6 +233,8 @@ def main(argv=None):
     if opts.cert:
         identity = (opts.cert, opts.key, opts.keypass)
         conn_properties["x-ssl-identity"] = identity
+    if opts.capture:
+        conn_properties["x-capture-file"] = opts.capture
     receiver_conn = PerfReceiveConnection("recv-conn",
                                           container,
                                           conn_properties,
@@ -243,6 +258,11 @@ def main(argv=None):
           % (total / delta, (receiver_conn.latency / total) * 1000.0,
              receiver_conn.latency_min * 1000.0,
              receiver_conn.latency_max * 1000.0))
+    histogram = receiver_conn.histogram
+    print("Latency p50: %.3fms p99: %.3fms p999: %.3fms"
+          % (histogram.percentile(50) * 1000.0,
+             histogram.percentile(99) * 1000.0,
+             histogram.percentile(99.9) * 1000.0))
     return 0
 
 
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+"""Replay the input recorded by a Connection's x-capture-file property.
+
+The recorded input is fed to a new Connection as fast as possible, with no
+network I/O, so that the cost of decoding, dispatching and handling real
+traffic can be measured and profiled.  Links opened by the peer are
+accepted, credit is granted to receive links and all received messages
+are accepted.
+"""
+
+import cProfile
+import optparse
+import pstats
+import sys
+import time
+
+import pyngus
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class ReplayHandler(pyngus.ConnectionEventHandler,
+                    pyngus.SenderEventHandler,
+                    pyngus.ReceiverEventHandler):
+    def __init__(self, credit):
+        self.credit = credit
+        self.messages = 0
+        self.links = []
+
+    def connection_failed(self, connection, error):
+        print("Connection failed: %s" % error)
+
+    def sender_requested(self, connection, link_handle,
+                         name, requested_source, properties):
+        link = connection.accept_sender(link_handle,
+                                        requested_source or name,
+                                        event_handler=self)
+        link.open()
+        self.links.append(link)
+
+    def receiver_requested(self, connection, link_handle,
+                           name, requested_target, properties):
+        link = connection.accept_receiver(link_handle,
+                                          requested_target or name,
+                                          event_handler=self)
+        link.add_capacity(self.credit)
+        link.open()
+        self.links.append(link)
+
+    def message_received(self, receiver_link, message, handle):
+        self.messages += 1
+        receiver_link.message_accepted(handle)
+        if receiver_link.capacity < self.credit / 2:
+            receiver_link.add_capacity(self.credit - receiver_link.capacity)
+
+
+def replay(capture, info, credit):
+    container = pyngus.Container("replay")
+    handler = ReplayHandler(credit)
+    properties = {"x-server": info.get("x-server", False)}
+    if info.get("x-sasl-mechs"):
+        properties["x-sasl-mechs"] = info["x-sasl-mechs"]
+    connection = container.create_connection(info.get("name", "replay"),
+                                             handler, properties)
+    connection.open()
+    start = _clock()
+    count = pyngus.replay_capture(capture, connection)
+    elapsed = _clock() - start
+    for link in handler.links:
+        link.destroy()
+    connection.destroy()
+    container.destroy()
+    return count, handler.messages, elapsed
+
+
+def main(argv=None):
+    _usage = """Usage: %prog [options] CAPTURE-FILE"""
+    parser = optparse.OptionParser(usage=_usage)
+    parser.add_option("--repeat", type="int", default=3,
+                      help="# of replays, the fastest replay is reported.")
+    parser.add_option("--credit", type="int", default=1000,
+                      help="Credit granted to each receive link.")
+    parser.add_option("--profile", action="store_true",
+                      help="Profile the replay and print the top functions.")
+    parser.add_option("--sort", default="cumulative",
+                      help="Profile sort order (default: cumulative).")
+    opts, extra = parser.parse_args(args=argv)
+    if len(extra) != 1:
+        parser.error("A capture file is required")
+    path = extra[0]
+    info, records = pyngus.read_capture(path)
+    records.close()
+
+    if opts.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(replay, path, info, opts.credit)
+        pstats.Stats(profiler).sort_stats(opts.sort).print_stats(30)
+        return 0
+
+    best = None
+    for i in range(opts.repeat):
+        count, messages, elapsed = replay(path, info, opts.credit)
+        best = elapsed if best is None else min(best, elapsed)
+    print("Replayed %s: %d bytes, %d messages, best of %d" %
+          (info.get("name"), count, messages, opts.repeat))
+    print("%.3f secs; %.1f MB/second; %d messages/second"
+          % (best, count / best / 1.0e6, messages / best))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
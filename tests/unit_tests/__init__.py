@@ -17,6 +17,9 @@
 # under the License.
 #
 
+from . import capture
 from . import container
 from . import connection
+from . import histogram
 from . import link
+from . import monitor
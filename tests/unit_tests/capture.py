@@ -0,0 +1,146 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from . import common
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from proton import Message
+from proton import SSLUnavailable
+from proton import TransportException
+
+import pyngus
+from pyngus.capture import INPUT, OUTPUT
+
+
+class _ReplayHandler(common.ConnCallback):
+    def __init__(self):
+        super(_ReplayHandler, self).__init__()
+        self.receiver_handler = common.ReceiverCallback()
+
+    def receiver_requested(self, connection, link_handle,
+                           name, requested_target, properties):
+        link = connection.accept_receiver(
+            link_handle, event_handler=self.receiver_handler)
+        link.add_capacity(10)
+        link.open()
+
+
+class APITest(common.Test):
+
+    def setup(self):
+        super(APITest, self).setup()
+        self.container = pyngus.Container("c")
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        self.container.destroy()
+        shutil.rmtree(self.tmpdir)
+        super(APITest, self).teardown()
+
+    def _send(self, server_props, count):
+        """Send count messages from a client to a server Connection."""
+        c1 = self.container.create_connection("c1")
+        c2_handler = _ReplayHandler()
+        c2 = self.container.create_connection("c2", c2_handler,
+                                              server_props)
+        c1.open()
+        c2.open()
+        sender = c1.create_sender("src", "tgt", common.SenderCallback())
+        sender.open()
+        common.process_connections(c1, c2)
+        for i in range(count):
+            sender.send(Message(body="message %d" % i))
+        common.process_connections(c1, c2)
+        assert c2_handler.receiver_handler.message_received_ct == count
+        c1.close()
+        c2.close()
+        common.process_connections(c1, c2)
+        c1.destroy()
+        c2.destroy()
+
+    def test_capture_file(self):
+        path = os.path.join(self.tmpdir, "capture")
+        self._send({"x-server": True, "x-capture-file": path}, 5)
+        info, records = pyngus.read_capture(path)
+        assert info["name"] == "c2"
+        assert info["x-server"] is True
+        records = list(records)
+        inputs = [r for r in records if r[0] == INPUT]
+        outputs = [r for r in records if r[0] == OUTPUT]
+        assert inputs and outputs
+        assert b"".join(r[2] for r in inputs).startswith(b"AMQP")
+        assert b"".join(r[2] for r in outputs).startswith(b"AMQP")
+        timestamps = [r[1] for r in records]
+        assert timestamps == sorted(timestamps)
+
+    def test_capture_legacy_server(self):
+        """The role of an x-ssl-server Connection is captured."""
+        capture = io.BytesIO()
+        try:
+            conn = self.container.create_connection(
+                "c1", None, {"x-ssl-server": True, "x-capture-file": capture})
+        except SSLUnavailable:
+            raise common.Skipped("SSL not available.")
+        conn.destroy()
+        capture.seek(0)
+        info, records = pyngus.read_capture(capture)
+        assert info["x-server"] is True
+
+    def test_replay(self):
+        capture = io.BytesIO()
+        self._send({"x-server": True, "x-capture-file": capture}, 5)
+        capture.seek(0)
+        handler = _ReplayHandler()
+        conn = self.container.create_connection("replay", handler,
+                                                {"x-server": True})
+        conn.open()
+        count = pyngus.replay_capture(capture, conn)
+        assert count > 0
+        assert handler.receiver_handler.message_received_ct == 5
+        assert handler.remote_closed_ct == 1
+        conn.destroy()
+
+    def test_capture_output_error(self):
+        """A transport error while capturing output fails the Connection."""
+        handler = common.ConnCallback()
+        conn = self.container.create_connection(
+            "c1", handler, {"x-capture-file": io.BytesIO()})
+        conn.open()
+        conn.process(time.time())
+        count = conn.has_output
+        assert count > 0
+
+        def _peek(size):
+            raise TransportException("peek failed")
+        conn._pn_transport.peek = _peek
+        conn.output_written(count)
+        conn.process(time.time())
+        assert handler.failed_ct > 0
+        assert "peek failed" in str(handler.failed_error)
+        conn.destroy()
+
+    def test_invalid_capture(self):
+        try:
+            pyngus.read_capture(io.BytesIO(b"not a capture file\n"))
+            assert False, "exception expected"
+        except Exception as e:
+            assert "Invalid capture file" in str(e)
@@ -103,14 +103,15 @@ def process_connections(c1, c2, timestamp=None):
 
 
 def _validate_conn_callback(connection):
-    """Callbacks must only occur when holding the Connection callback lock"""
-    assert connection._callback_lock.in_callback, \
-        connection._callback_lock.in_callback
+    """Callbacks must only occur when the Connection is in callback"""
+    assert connection._in_callback, connection._in_callback
 
 
 def _validate_link_callback(link):
-    """Callbacks must only occur when holding the Link callback lock."""
-    assert link._callback_lock.in_callback, link._callback_lock.in_callback
+    """Callbacks must only occur when the Link and its Connection are in
+    callback."""
+    assert link._in_callback, link._in_callback
+    assert link.connection._in_callback, link.connection._in_callback
 
 
 class ConnCallback(pyngus.ConnectionEventHandler):
@@ -239,6 +240,8 @@ class ReceiverCallback(pyngus.ReceiverEventHandler):
         self.closed_ct = 0
         self.message_received_ct = 0
         self.received_messages = []
+        self.message_chunk_ct = 0
+        self.received_chunks = []
 
     def receiver_active(self, receiver_link):
         _validate_link_callback(receiver_link)
@@ -261,3 +264,9 @@ class ReceiverCallback(pyngus.ReceiverEventHandler):
         _validate_conn_callback(receiver_link.connection)
         self.message_received_ct += 1
         self.received_messages.append((message, handle))
+
+    def message_chunk(self, receiver_link, handle, data, more):
+        _validate_link_callback(receiver_link)
+        _validate_conn_callback(receiver_link.connection)
+        self.message_chunk_ct += 1
+        self.received_chunks.append((handle, data, more))
@@ -18,16 +18,21 @@
 #
 from . import common
 # import logging
+import logging
 import os
 import shutil
 import subprocess
+import sys
 import tempfile
 import time
+import weakref
 from string import Template
 import ssl
 
+import proton
 from proton import Condition
 from proton import Message
+from proton import SSLDomain
 from proton import SSLUnavailable
 from proton import SSLException
 from proton import SASL
@@ -187,6 +192,34 @@ class APITest(common.Test):
         c1 = self.container1.get_connection("c1")
         assert c1.user_context == "Hi There"
 
+    def test_skip_events(self):
+        """Verify events without a handler are popped from a real
+        proton.Collector without being wrapped.
+        """
+        if not pyngus.connection._pn_collector_peek:
+            raise common.Skipped("cproton not available.")
+        collector = proton.Collector()
+        pn_transport = proton.Transport()
+        collector.put(pn_transport, proton.Event.TRANSPORT)
+        collector.put(pn_transport, proton.Event.TRANSPORT)
+        proton.Connection().collect(collector)  # CONNECTION_INIT
+        assert pyngus.connection._skip_events(collector) == 2
+        assert collector.peek().type == proton.Event.CONNECTION_INIT
+        assert pyngus.connection._skip_events(collector) == 0
+
+    def test_weakref(self):
+        c1 = self.container1.create_connection("c1")
+        sender = c1.create_sender("src", "tgt")
+        receiver = c1.create_receiver("tgt2", "src2")
+        for obj in (c1, sender, receiver):
+            ref = weakref.ref(obj)
+            assert ref() is obj
+            try:
+                obj.context = "Hi There"
+                assert False, "AttributeError expected"
+            except AttributeError:
+                pass
+
     def test_active_callback(self):
         c1_events = common.ConnCallback()
         c2_events = common.ConnCallback()
@@ -283,6 +316,75 @@ class APITest(common.Test):
         assert c1.active and c2.active
         assert c1.next_tick != 0 and c2.next_tick != 0
 
+    def test_trace_buffer(self):
+        props = {"x-trace-buffer": 3}
+        c1 = self.container1.create_connection("c1", properties=props)
+        c2 = self.container2.create_connection("c2")
+        assert c2.trace_frames == []
+        c1.open()
+        c2.open()
+        common.process_connections(c1, c2)
+        assert c1.active and c2.active
+        frames = c1.trace_frames
+        assert len(frames) == 3
+        assert "@open" in frames[-1][1], frames
+        assert frames[0][0] <= frames[-1][0]
+        c1.close()
+        c2.close()
+        common.process_connections(c1, c2)
+        # only the most recent frames are kept:
+        frames = c1.trace_frames
+        assert len(frames) == 3
+        assert "@close" in frames[1][1], frames
+
+    def test_trace_sample(self):
+        props = {"x-trace-buffer": 100, "x-trace-sample": 2}
+        c1 = self.container1.create_connection("c1", properties=props)
+        c2 = self.container2.create_connection("c2")
+        c1.open()
+        c2.open()
+        common.process_connections(c1, c2)
+        # AMQP header and open frame in each direction, 1 in 2 kept:
+        assert len(c1.trace_frames) == 2, c1.trace_frames
+        try:
+            self.container1.create_connection("c3", properties={
+                "x-trace-buffer": 10, "x-trace-sample": 0})
+            assert False, "exception expected"
+        except Exception as e:
+            assert "x-trace-sample" in str(e)
+
+    def test_trace_dump_on_failure(self):
+        records = []
+
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        handler = Handler()
+        logger = logging.getLogger("pyngus.connection")
+        logger.addHandler(handler)
+        try:
+            c1_events = common.ConnCallback()
+            props = {"x-trace-buffer": 10}
+            c1 = self.container1.create_connection("c1", c1_events, props)
+            c2 = self.container2.create_connection("c2")
+            c1.open()
+            c2.open()
+            common.process_connections(c1, c2)
+            c1.dump_trace(logging.WARNING)
+            dumps = [r for r in records if "traced frames" in r.getMessage()]
+            assert len(dumps) == 1
+            assert dumps[0].levelno == logging.WARNING
+            assert "@open" in dumps[0].getMessage()
+            c1.process_input(b"garbage garbage garbage")
+            c1.process(time.time())
+            assert c1_events.failed_ct == 1
+            dumps = [r for r in records if "traced frames" in r.getMessage()]
+            assert len(dumps) == 2
+            assert dumps[1].levelno == logging.ERROR
+        finally:
+            logger.removeHandler(handler)
+
     def test_properties_hostname(self):
         props = {"hostname": "TomServo"}
         c1 = self.container1.create_connection("c1", properties=props)
@@ -515,6 +617,151 @@ class APITest(common.Test):
         except SSLUnavailable:
             raise common.Skipped("SSL not available.")
 
+    def test_ssl_connection_config(self):
+        """Verify Connections created from a shared ConnectionConfig."""
+        def _testpath(file):
+            return os.path.join(os.path.dirname(__file__),
+                                "ssl_db/%s" % file)
+        try:
+            s_config = pyngus.ConnectionConfig(
+                {"x-ssl-server": True,
+                 "x-ssl-identity": (_testpath("server-certificate.pem"),
+                                    _testpath("server-private-key.pem"),
+                                    "server-password")})
+            c_config = pyngus.ConnectionConfig(
+                {"x-ssl-ca-file": _testpath("ca-certificate.pem"),
+                 "x-ssl-verify-mode": "verify-peer",
+                 "x-ssl-peer-name": "some.server.com"})
+        except SSLUnavailable:
+            raise common.Skipped("SSL not available.")
+        for i in range(3):
+            server = self.container1.create_connection("server-%d" % i,
+                                                       properties=s_config)
+            client = self.container2.create_connection("client-%d" % i,
+                                                       properties=c_config)
+            server.open()
+            client.open()
+            common.process_connections(server, client)
+            assert server.active and client.active
+
+    def test_ssl_domain_cache(self):
+        """Verify Connections with the same SSL configuration share the
+        SSL domain until the cache is cleared.
+        """
+        def _testpath(file):
+            return os.path.join(os.path.dirname(__file__),
+                                "ssl_db/%s" % file)
+        pyngus.clear_ssl_domains()
+        s_props = {"x-ssl-server": True,
+                   "x-ssl-identity": (_testpath("server-certificate.pem"),
+                                      _testpath("server-private-key.pem"),
+                                      "server-password")}
+        c_props = {"x-ssl-ca-file": _testpath("ca-certificate.pem"),
+                   "x-ssl-verify-mode": "verify-peer",
+                   "x-ssl-peer-name": "some.server.com"}
+        try:
+            for i in range(2):
+                server = self.container1.create_connection(
+                    "server-%d" % i, properties=s_props)
+                client = self.container2.create_connection(
+                    "client-%d" % i, properties=c_props)
+                server.open()
+                client.open()
+                common.process_connections(server, client)
+                assert server.active and client.active
+        except SSLUnavailable:
+            raise common.Skipped("SSL not available.")
+        assert len(pyngus.connection._SSL_DOMAINS) == 2
+        # the key password is not kept in the cache:
+        assert "server-password" not in repr(
+            list(pyngus.connection._SSL_DOMAINS))
+        path = _testpath("server-private-key.pem")
+        assert pyngus.clear_ssl_domains(path) == 1
+        assert pyngus.clear_ssl_domains() == 1
+        assert len(pyngus.connection._SSL_DOMAINS) == 0
+        # existing connections are not affected:
+        server.close()
+        client.close()
+        common.process_connections(server, client)
+        assert server.closed and client.closed
+
+    def test_ssl_domain_cache_limit(self):
+        """Verify the least recently used SSL domains are discarded."""
+        ca_file = os.path.join(os.path.dirname(__file__),
+                               "ssl_db/ca-certificate.pem")
+        pyngus.clear_ssl_domains()
+        saved = pyngus.connection._SSL_DOMAINS_MAX
+        pyngus.connection._SSL_DOMAINS_MAX = 2
+        try:
+            for props in [{"x-ssl-verify-mode": "no-verify"},
+                          {"x-ssl-ca-file": ca_file},
+                          {"x-ssl-server": True},
+                          {"x-ssl-ca-file": ca_file}]:
+                pyngus.ConnectionConfig(props)
+                assert len(pyngus.connection._SSL_DOMAINS) <= 2
+        except SSLUnavailable:
+            raise common.Skipped("SSL not available.")
+        finally:
+            pyngus.connection._SSL_DOMAINS_MAX = saved
+        # the anonymous client domain was evicted, the client domain with
+        # the CA file was used last:
+        cached = [(key[0], key[2]) for key in pyngus.connection._SSL_DOMAINS]
+        assert cached == [(SSLDomain.MODE_SERVER, None),
+                          (SSLDomain.MODE_CLIENT, ca_file)], cached
+        pyngus.clear_ssl_domains()
+
+    def test_ssl_session_resume(self):
+        """Verify a client resumes the SSL session of the previous
+        connection with the same session id.
+        """
+        def _testpath(file):
+            return os.path.join(os.path.dirname(__file__),
+                                "ssl_db/%s" % file)
+        s_props = {"x-ssl-server": True,
+                   "x-ssl-identity": (_testpath("server-certificate.pem"),
+                                      _testpath("server-private-key.pem"),
+                                      "server-password")}
+        c_props = {"x-ssl-ca-file": _testpath("ca-certificate.pem"),
+                   "x-ssl-verify-mode": "verify-peer",
+                   "x-ssl-peer-name": "some.server.com",
+                   "x-ssl-session-id": True}
+        # discard sessions cached by other tests:
+        pyngus.clear_ssl_domains()
+        resumed = []
+        try:
+            for i in range(2):
+                server = self.container1.create_connection(
+                    "server-%d" % i, properties=s_props)
+                client = self.container2.create_connection(
+                    "client-%d" % i, properties=c_props)
+                server.open()
+                client.open()
+                common.process_connections(server, client)
+                assert server.active and client.active
+                resumed.append(client.ssl_resumed)
+                client.close()
+                server.close()
+                common.process_connections(server, client)
+                assert server.closed and client.closed
+                server.destroy()
+                client.destroy()
+        except SSLUnavailable:
+            raise common.Skipped("SSL not available.")
+        assert resumed == [False, True], resumed
+
+    def test_ssl_session_id_invalid(self):
+        for props in [{"x-ssl-session-id": "broker"},
+                      {"x-ssl-server": True, "x-ssl-session-id": "broker"},
+                      {"x-ssl": True, "x-ssl-verify-mode": "no-verify",
+                       "x-ssl-session-id": True}]:
+            try:
+                pyngus.ConnectionConfig(props)
+                assert False, "exception expected"
+            except SSLUnavailable:
+                raise common.Skipped("SSL not available.")
+            except Exception as e:
+                assert "x-ssl-session-id" in str(e), str(e)
+
     def test_io_input_close(self):
         """Premature input close should trigger failed callback."""
         cb1 = common.ConnCallback()
@@ -566,6 +813,17 @@ class APITest(common.Test):
         except RuntimeError:
             pass
 
+    def test_reentrancy_checks_disabled(self):
+        """Reentrancy checks are removed if PYNGUS_NO_REENTRANCY_CHECKS is
+        set when pyngus is imported."""
+        script = ("import pyngus;"
+                  "assert pyngus.Connection.process.__name__ == 'process';"
+                  "assert pyngus.SenderLink.destroy.__name__ == 'destroy'")
+        env = dict(os.environ, PYNGUS_NO_REENTRANCY_CHECKS="1")
+        subprocess.check_call([sys.executable, "-c", script], env=env)
+        # enabled by default:
+        assert pyngus.Connection.process.__name__ == 'wrap'
+
     def _test_accept_receiver_sync(self, r_conn_handler,
                                    src_addr, tgt_addr, name):
 
@@ -1072,3 +1330,27 @@ class SASLTest(common.Test):
                                                properties=props)
         p = self._header_protocol(c1)
         assert p == 0, "Bad protocol - expect '0' got '%s'" % p
+        # the properties may be shared by other connections:
+        assert props == {'x-force-sasl': False}
+
+    def test_connection_config(self):
+        """Verify Connections can be created from a ConnectionConfig.
+        """
+        props = {'x-sasl-mechs': 'anonymous'}
+        config = pyngus.ConnectionConfig(props)
+        props['x-sasl-mechs'] = 'PLAIN'
+        assert config.properties == {'x-sasl-mechs': 'anonymous'}
+        assert not config.server
+        for name in ["c1", "c2"]:
+            c = self.container1.create_connection(name, properties=config)
+            p = self._header_protocol(c)
+            assert p == 3, "Bad protocol - expect '3' got '%s'" % p
+        invalid = [({"x-trace-buffer": 10, "x-trace-sample": 0},
+                    "x-trace-sample"),
+                   ({"x-capture-file": "/tmp/capture"}, "x-capture-file")]
+        for props, key in invalid:
+            try:
+                pyngus.ConnectionConfig(props)
+                assert False, "exception expected"
+            except Exception as e:
+                assert key in str(e), str(e)
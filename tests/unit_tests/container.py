@@ -18,6 +18,9 @@
 #
 from . import common
 import gc
+import time
+
+from proton import Message
 
 import pyngus
 
@@ -103,3 +106,100 @@ class APITest(common.Test):
         assert not w
         assert len(t) == 2 and c3 in t and c4 in t
         container.destroy()
+
+    def _setup_link(self, container, name):
+        """Create a pair of connections with a link from the first to the
+        second.  Returns the connections and links.
+        """
+        c_handler = common.ConnCallback()
+        c1 = container.create_connection(name + "-1", c_handler)
+        c2 = container.create_connection(name + "-2")
+        c1.open()
+        c2.open()
+        rl_handler = common.ReceiverCallback()
+        receiver = c2.create_receiver("tgt", "src", rl_handler)
+        receiver.open()
+        common.process_connections(c1, c2)
+        args = c_handler.sender_requested_args[0]
+        sender = c1.accept_sender(args.link_handle)
+        sender.open()
+        common.process_connections(c1, c2)
+        assert sender.active and receiver.active
+        return c1, c2, sender, receiver, rl_handler
+
+    def test_process_pending(self):
+        container = pyngus.Container("abc")
+        pairs = [self._setup_link(container, "a"),
+                 self._setup_link(container, "b")]
+        for c1, c2, sender, receiver, rl_handler in pairs:
+            receiver.add_capacity(10)
+            common.process_connections(c1, c2)
+            for i in range(10):
+                msg = Message()
+                msg.body = "Hi %d" % i
+                sender.send(msg)
+            c1.process(time.time())
+            common.do_connection_io(c1, c2)
+        now = time.time()
+        for c1, c2, sender, receiver, rl_handler in pairs:
+            assert c2.process(now, max_events=2) == now
+            assert c2.work_pending
+            assert rl_handler.message_received_ct < 10
+        pending = container.process_pending(now, max_events=2)
+        # serviced in round-robin order:
+        assert pending == [pairs[0][1], pairs[1][1]]
+        while pending:
+            pending = container.process_pending(now, max_events=2)
+        for c1, c2, sender, receiver, rl_handler in pairs:
+            assert not c2.work_pending
+            assert rl_handler.message_received_ct == 10
+        # an unlimited budget processes all events:
+        c1, c2, sender, receiver, rl_handler = pairs[0]
+        receiver.add_capacity(1)
+        common.process_connections(c1, c2)
+        sender.send(Message())
+        c1.process(now)
+        common.do_connection_io(c1, c2)
+        c2.process(now, max_time=60.0)
+        assert not c2.work_pending
+        assert rl_handler.message_received_ct == 11
+        container.destroy()
+
+    def test_memory_footprint(self):
+        """Measure the memory used by idle Connections and links, and verify
+        they are not carrying a per-instance __dict__.
+        """
+        try:
+            import tracemalloc
+        except ImportError:
+            raise common.Skipped("tracemalloc not available")
+        count = 200
+        container = pyngus.Container("abc")
+        tracemalloc.start()
+        try:
+            start = tracemalloc.get_traced_memory()[0]
+            conns = [container.create_connection("c-%d" % i)
+                     for i in range(count)]
+            for c in conns:
+                c.open()
+            conn_size = tracemalloc.get_traced_memory()[0] - start
+            start = tracemalloc.get_traced_memory()[0]
+            links = [c.create_sender("src-%d" % i)
+                     for i, c in enumerate(conns)]
+            links += [c.create_receiver("tgt-%d" % i)
+                      for i, c in enumerate(conns)]
+            for link in links:
+                link.open()
+            link_size = tracemalloc.get_traced_memory()[0] - start
+        finally:
+            tracemalloc.stop()
+        if self.verbose:
+            print("bytes per idle connection: %d, per idle link: %d"
+                  % (conn_size // count, link_size // len(links)))
+        objs = [conns[0], links[0], links[-1],
+                links[0]._pn_link.session.context]
+        for obj in objs:
+            assert not hasattr(obj, "__dict__"), obj
+        for link in links:
+            link.destroy()
+        container.destroy()
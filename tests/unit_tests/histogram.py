@@ -0,0 +1,67 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from . import common
+
+from pyngus import LatencyHistogram
+
+
+class APITest(common.Test):
+
+    def test_empty(self):
+        h = LatencyHistogram()
+        assert h.count == 0
+        assert h.percentile(99) is None
+        assert h.mean is None and h.min is None and h.max is None
+
+    def test_percentiles(self):
+        h = LatencyHistogram()
+        # 1 to 10000 microseconds
+        for i in range(1, 10001):
+            h.record(i / 1000000.0)
+        assert h.count == 10000
+        assert h.min == 0.000001 and h.max == 0.01
+        for percent in (50, 90, 99, 99.9):
+            expected = percent / 100.0 * 0.01
+            value = h.percentile(percent)
+            assert abs(value - expected) <= expected * 0.04, (percent, value)
+        assert h.percentile(100) == h.max
+        assert h.percentile(0) == h.min
+
+    def test_large_values(self):
+        h = LatencyHistogram()
+        h.record(-1.0)
+        h.record(2 * LatencyHistogram.MAX_VALUE)
+        assert h.count == 2
+        assert h.percentile(50) == 0.0
+        assert h.percentile(100) == 2 * LatencyHistogram.MAX_VALUE
+
+    def test_merge(self):
+        h1 = LatencyHistogram()
+        h2 = LatencyHistogram()
+        for i in range(100):
+            h1.record(0.001)
+            h2.record(0.1)
+        h2.record(1.0)
+        merged = LatencyHistogram().merge(h1).merge(h2)
+        assert merged.count == 201
+        assert merged.min == 0.001 and merged.max == 1.0
+        assert abs(merged.percentile(25) - 0.001) < 0.0001
+        assert abs(merged.percentile(75) - 0.1) < 0.004
+        merged.reset()
+        assert merged.count == 0 and merged.percentile(50) is None
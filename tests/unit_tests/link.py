@@ -21,6 +21,7 @@ from . import common
 import time
 
 from proton import Condition
+from proton import Endpoint
 from proton import Message
 from proton import symbol
 
@@ -301,6 +302,192 @@ class APITest(common.Test):
         assert sender.credit == 1
         assert sl_handler.credit_granted_ct == 3
 
+    def test_links_per_session(self):
+        self.teardown()
+        self.setup(conn1_props={"x-links-per-session": 2})
+        senders = [self.conn1.create_sender("src-%d" % i, "tgt-%d" % i)
+                   for i in range(3)]
+        sessions = [s._pn_link.session.context for s in senders]
+        assert sessions[0] is sessions[1]
+        assert sessions[2] is not sessions[0]
+        for sender in senders:
+            sender.open()
+        self.process_connections()
+        assert self.conn2_handler.receiver_requested_ct == 3
+        for args in self.conn2_handler.receiver_requested_args:
+            receiver = self.conn2.accept_receiver(args.link_handle)
+            receiver.open()
+        self.process_connections()
+        assert all(s.active for s in senders)
+        # shared session stays open until its last link is destroyed:
+        senders[0].close()
+        self.process_connections()
+        senders[0].destroy()
+        assert senders[1]._pn_link.session.state & Endpoint.LOCAL_ACTIVE
+        receiver = self.conn1.create_receiver("tgt-3")
+        assert receiver._pn_link.session.context is sessions[2]
+
+    def test_session_windows(self):
+        self.teardown()
+        self.setup(conn1_props={"x-session-incoming-capacity": 65536,
+                                "x-session-outgoing-window": 100})
+        sender, receiver = self._setup_sender_sync()
+        session = sender._pn_link.session.context
+        assert session.incoming_capacity == 65536
+        assert session.outgoing_window == 100
+        session = receiver._pn_link.session.context
+        assert session.incoming_capacity == 0  # default - not limited
+
+    def _send_large(self, sender, receiver):
+        """Move a message that fills most of the receiving session's window
+        to the receiving connection, without processing it.
+        """
+        msg = Message()
+        msg.body = "X" * 1500
+        sender.send(msg)
+        self.conn1.process(time.time())
+        common.do_connection_io(self.conn1, self.conn2)
+
+    def test_session_autotune(self):
+        self.teardown()
+        autotune = {"interval": 0, "max-capacity": 4096}
+        self.setup(conn1_props={"max-frame-size": 512},
+                   conn2_props={"max-frame-size": 512,
+                                "x-session-incoming-capacity": 2048,
+                                "x-session-autotune": autotune})
+        sender, receiver = self._setup_sender_sync()
+        session = receiver._pn_link.session.context
+        assert session.incoming_capacity == 2048
+        receiver.add_capacity(2)
+        self.process_connections()
+        # window filled: capacity grows up to max-capacity
+        for i in range(2):
+            self._send_large(sender, receiver)
+            self.conn2.process(time.time())
+            assert session.incoming_capacity == 4096
+            self.process_connections()
+        assert receiver.user_context.message_received_ct == 2
+
+    def test_session_autotune_memory(self):
+        self.teardown()
+        autotune = {"interval": 0, "min-capacity": 1024,
+                    "memory-limit": 1024}
+        self.setup(conn1_props={"max-frame-size": 512},
+                   conn2_props={"max-frame-size": 512,
+                                "x-session-incoming-capacity": 4096,
+                                "x-session-autotune": autotune})
+        sender, receiver = self._setup_sender_sync()
+        session = receiver._pn_link.session.context
+        receiver.add_capacity(1)
+        self.process_connections()
+        # buffered data over the memory limit: capacity shrinks
+        self._send_large(sender, receiver)
+        self.conn2.process(time.time())
+        assert session.incoming_capacity == 2048
+        self.process_connections()
+        assert receiver.user_context.message_received_ct == 1
+
+    def test_stats(self):
+        sender, receiver = self._setup_sender_sync()
+        stats = sender.stats()
+        assert stats["sent"] == 0 and stats["pending"] == 0
+        callbacks, handles = self._send_batch(sender, receiver, 3)
+        stats = receiver.stats()
+        assert stats["received"] == 3 and stats["unsettled"] == 3
+        receiver.message_accepted(handles[0])
+        receiver.message_rejected(handles[1])
+        receiver.message_released(handles[2])
+        sender.send(Message())  # no credit
+        self.process_connections()
+        stats = sender.stats()
+        assert stats["sent"] == 3
+        assert stats["accepted"] == 1
+        assert stats["rejected"] == 1
+        assert stats["released"] == 1
+        assert stats["pending"] == 1 and stats["queued"] == 1
+        assert stats["credit"] == 0
+        stats = receiver.stats()
+        assert stats["unsettled"] == 0 and stats["credit"] == 0
+
+        stats1 = self.conn1.stats()
+        stats2 = self.conn2.stats()
+        assert stats1["bytes-out"] == stats2["bytes-in"] > 0
+        assert stats1["bytes-in"] == stats2["bytes-out"] > 0
+        assert stats1["frames-out"] == stats2["frames-in"] > 0
+        assert stats1["senders"] == 1 and stats2["receivers"] == 1
+
+        totals = self.container1.stats()
+        assert totals["connections"]["count"] == 1
+        assert totals["connections"]["bytes-out"] == stats1["bytes-out"]
+        assert totals["senders"]["accepted"] == 1
+        assert not totals["receivers"]
+
+    def test_latency_histograms(self):
+        sl_handler = common.SenderCallback()
+        sender = self.conn1.create_sender("src", "tgt", sl_handler,
+                                          properties={
+                                              "x-latency-histograms": True})
+        sender.user_context = sl_handler
+        sender.open()
+        self.process_connections()
+        args = self.conn2_handler.receiver_requested_args[0]
+        rl_handler = common.ReceiverCallback()
+        receiver = self.conn2.accept_receiver(args.link_handle,
+                                              event_handler=rl_handler)
+        receiver.user_context = rl_handler
+        receiver.open()
+        self.process_connections()
+        assert sender.delivery_latency.count == 0
+        callbacks, handles = self._send_batch(sender, receiver, 2)
+        # queued until credit arrived:
+        assert sender.queue_latency.count == 2
+        for handle in handles:
+            receiver.message_accepted(handle)
+        self.process_connections()
+        assert sender.delivery_latency.count == 2
+        assert sender.delivery_latency.percentile(99) > 0
+
+        # not enabled by default:
+        other = self.conn1.create_sender("src2", "tgt2")
+        assert other.delivery_latency is None
+        assert other.queue_latency is None
+
+    def test_credit_coalesced(self):
+        sender, receiver = self._setup_sender_sync()
+        sl_handler = sender.user_context
+        callbacks, handles = self._send_batch(sender, receiver, 1)
+        granted = sl_handler.credit_granted_ct
+        calls = []
+
+        process_credit = pyngus.SenderLink._process_credit
+
+        def _process_credit(link):
+            calls.append(link.credit)
+            process_credit(link)
+        # queue two flow updates separated by a disposition update before
+        # the sender reads them:
+        updates = [lambda: receiver.add_capacity(1),
+                   lambda: receiver.message_accepted(handles[0]),
+                   lambda: receiver.add_capacity(1)]
+        data = b""
+        for update in updates:
+            update()
+            self.conn2.process(time.time())
+            output = self.conn2.output_data()
+            self.conn2.output_written(len(output))
+            data += output
+        assert self.conn1.process_input(data) == len(data)
+        pyngus.SenderLink._process_credit = _process_credit
+        try:
+            self.conn1.process(time.time())
+        finally:
+            pyngus.SenderLink._process_credit = process_credit
+        assert sender.credit == 2
+        assert callbacks[0].count == 1
+        # credit is processed once for the whole processing pass:
+        assert calls == [2]
+        assert sl_handler.credit_granted_ct == granted + 1
+
     def test_send_presettled(self):
         sender, receiver = self._setup_sender_sync()
         rl_handler = receiver.user_context
@@ -394,6 +581,145 @@ class APITest(common.Test):
         info = cb.info.get("message-annotations")
         assert info and info["dog"] == 1
 
+    def _send_batch(self, sender, receiver, count):
+        """Send count messages, return their delivery callbacks and receive
+        handles in arrival order.
+        """
+        rl_handler = receiver.user_context
+        received = rl_handler.message_received_ct
+        receiver.add_capacity(count)
+        callbacks = []
+        for i in range(count):
+            msg = Message()
+            msg.body = "Hi %d" % i
+            cb = common.DeliveryCallback()
+            sender.send(msg, cb, "handle-%d" % i)
+            callbacks.append(cb)
+        self.process_connections()
+        assert rl_handler.message_received_ct == received + count
+        handles = [h for m, h in rl_handler.received_messages[received:]]
+        return callbacks, handles
+
+    def test_accept_batch(self):
+        sender, receiver = self._setup_sender_sync()
+        callbacks, handles = self._send_batch(sender, receiver, 4)
+        receiver.accept_batch([handles[3], handles[1]])
+        self.process_connections()
+        assert [cb.count for cb in callbacks] == [0, 1, 0, 1]
+        assert callbacks[1].status == pyngus.SenderLink.ACCEPTED
+        assert callbacks[3].status == pyngus.SenderLink.ACCEPTED
+        try:
+            receiver.accept_batch([handles[0], handles[1]])
+            assert False, "Exception expected!"
+        except Exception:
+            pass
+        # a failed batch settles nothing:
+        receiver.accept_batch([handles[0], handles[2]])
+        self.process_connections()
+        assert [cb.count for cb in callbacks] == [1, 1, 1, 1]
+        assert sender.pending == 0
+
+    def test_accept_through(self):
+        sender, receiver = self._setup_sender_sync()
+        callbacks, handles = self._send_batch(sender, receiver, 5)
+        receiver.message_released(handles[1])
+        receiver.accept_through(handles[2])
+        self.process_connections()
+        assert [cb.count for cb in callbacks] == [1, 1, 1, 0, 0]
+        assert callbacks[0].status == pyngus.SenderLink.ACCEPTED
+        assert callbacks[1].status == pyngus.SenderLink.RELEASED
+        assert callbacks[2].status == pyngus.SenderLink.ACCEPTED
+        try:
+            receiver.accept_through(handles[0])
+            assert False, "Exception expected!"
+        except Exception:
+            pass
+        receiver.accept_through(handles[4])
+        self.process_connections()
+        assert [cb.count for cb in callbacks] == [1, 1, 1, 1, 1]
+        assert callbacks[4].status == pyngus.SenderLink.ACCEPTED
+        assert sender.pending == 0
+
+    def test_held_delivery(self):
+        """Verify a long held delivery does not pin the settled ones."""
+        sender, receiver = self._setup_sender_sync()
+        callbacks, handles = self._send_batch(sender, receiver, 1)
+        held = handles[0]
+        for i in range(3):
+            callbacks, handles = self._send_batch(sender, receiver, 1000)
+            for handle in handles:
+                receiver.message_accepted(handle)
+        unsettled = receiver._unsettled_deliveries
+        assert len(unsettled) == 1
+        assert len(unsettled._items) < unsettled._COMPACT
+        for handle in (1.0, str(held), None):
+            try:
+                receiver.message_accepted(handle)
+                assert False, "Exception expected!"
+            except Exception as e:
+                assert "Invalid message handle" in str(e), str(e)
+        receiver.accept_through(held)
+        assert len(unsettled) == 0
+        self.process_connections()
+        assert sender.pending == 0
+
+    def test_receive_handles(self):
+        sender, receiver = self._setup_sender_sync()
+        callbacks, handles = self._send_batch(sender, receiver, 6)
+        assert len(set(handles)) == 6
+        receiver.message_accepted(handles[0])
+        receiver.message_rejected(handles[3])
+        receiver.message_released(handles[5])
+        for handle in (handles[0], handles[3], handles[5], "bad-handle"):
+            try:
+                receiver.message_accepted(handle)
+                assert False, "Exception expected!"
+            except Exception:
+                pass
+        receiver.accept_through(handles[4])
+        self.process_connections()
+        assert [cb.count for cb in callbacks] == [1] * 6
+        status = [cb.status for cb in callbacks]
+        assert status == [pyngus.SenderLink.ACCEPTED,
+                          pyngus.SenderLink.ACCEPTED,
+                          pyngus.SenderLink.ACCEPTED,
+                          pyngus.SenderLink.REJECTED,
+                          pyngus.SenderLink.ACCEPTED,
+                          pyngus.SenderLink.RELEASED]
+        # new handles continue to be unique after the receiver is drained:
+        callbacks, handles2 = self._send_batch(sender, receiver, 2)
+        assert not set(handles).intersection(handles2)
+        receiver.accept_batch(handles2)
+
+    def test_auto_accept(self):
+        sl_handler = common.SenderCallback()
+        sender = self.conn1.create_sender("src", "tgt", sl_handler)
+        sender.open()
+        self.process_connections()
+        args = self.conn2_handler.receiver_requested_args[0]
+        rl_handler = common.ReceiverCallback()
+        props = {"x-auto-accept": True}
+        receiver = self.conn2.accept_receiver(args.link_handle,
+                                              event_handler=rl_handler,
+                                              properties=props)
+        receiver.add_capacity(3)
+        receiver.open()
+        self.process_connections()
+        callbacks = []
+        for i in range(3):
+            msg = Message()
+            msg.body = "Hi %d" % i
+            cb = common.DeliveryCallback()
+            sender.send(msg, cb, "handle-%d" % i)
+            callbacks.append(cb)
+        self.process_connections()
+        assert rl_handler.message_received_ct == 3
+        assert [h for m, h in rl_handler.received_messages] == [None] * 3
+        assert [cb.status for cb in callbacks] == \
+            [pyngus.SenderLink.ACCEPTED] * 3
+        assert len(receiver._unsettled_deliveries) == 0
+        assert sender.pending == 0
+
     def test_send_expired_no_credit(self):
         cb = common.DeliveryCallback()
         sender, receiver = self._setup_receiver_sync()
@@ -610,6 +936,59 @@ class APITest(common.Test):
         assert cb.count
         assert cb.status == pyngus.SenderLink.ACCEPTED
 
+    def test_streaming_receive(self):
+        """Verify partial deliveries are passed up as they arrive."""
+
+        self.teardown()
+        props = {"max-frame-size": 512}
+        self.setup(conn1_props=props, conn2_props=props)
+
+        sender1 = self.conn1.create_sender("src1", "tgt1")
+        sender1.open()
+        self.process_connections()
+        args = self.conn2_handler.receiver_requested_args[0]
+        rl_handler = common.ReceiverCallback()
+        receiver1 = self.conn2.accept_receiver(args.link_handle,
+                                               event_handler=rl_handler,
+                                               properties={"x-streaming":
+                                                           True})
+        receiver1.add_capacity(2)
+        receiver1.open()
+        self.process_connections()
+
+        msg = Message()
+        msg.body = "Hi!" * 512  # > max frame size
+        cb = common.DeliveryCallback()
+        sender1.send(msg, cb)
+        sender1.send(msg, cb)
+        # manually transfer output from conn1 to conn2 in small batches,
+        # forcing conn2 to process partial deliveries:
+        self.conn1.process(time.time())
+        while self.conn1.has_output:
+            count = min(self.conn1.has_output, 512)
+            part = self.conn1.output_data()[:count]
+            count = self.conn2.process_input(part)
+            self.conn2.process(time.time())
+            self.conn1.output_written(count)
+        assert rl_handler.message_received_ct == 0
+        chunks = rl_handler.received_chunks
+        assert len(chunks) > 2
+        ends = [i for i, c in enumerate(chunks) if not c[2]]
+        assert len(ends) == 2
+        handle1 = chunks[0][0]
+        assert all(c[0] == handle1 for c in chunks[:ends[0] + 1])
+        handle2 = chunks[-1][0]
+        assert handle2 != handle1
+        for start, end in ((0, ends[0]), (ends[0] + 1, ends[1])):
+            rmsg = Message()
+            rmsg.decode(b"".join(c[1] for c in chunks[start:end + 1]))
+            assert rmsg.body == msg.body
+        assert receiver1.capacity == 0
+        receiver1.accept_batch([handle1, handle2])
+        self.process_connections()
+        assert cb.count == 2
+        assert cb.status == pyngus.SenderLink.ACCEPTED
+
     def test_dynamic_receiver_props(self):
         """Verify dynamic-node-properties can be requested."""
         # dynamic receive link:
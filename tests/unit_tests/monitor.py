@@ -0,0 +1,172 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+from . import common
+import socket
+import time
+
+from proton import Message
+
+import pyngus
+
+
+class _Profiler(pyngus.CallbackProfiler):
+    def __init__(self, threshold):
+        super(_Profiler, self).__init__(threshold)
+        self.slow = []
+
+    def slow_callback(self, connection, name, elapsed):
+        self.slow.append((connection.name, name))
+
+
+class _SlowReceiver(common.ReceiverCallback):
+    def message_received(self, receiver_link, message, handle):
+        time.sleep(0.05)
+        super(_SlowReceiver, self).message_received(receiver_link, message,
+                                                    handle)
+
+
+class CallbackProfilerTest(common.Test):
+
+    def setup(self):
+        super(CallbackProfilerTest, self).setup()
+        self.profiler = _Profiler(0.04)
+        props = {"x-callback-profiler": self.profiler}
+        self.container = pyngus.Container("c")
+        self.conn1 = self.container.create_connection("c1",
+                                                      common.ConnCallback(),
+                                                      props)
+        self.conn2_handler = common.ConnCallback()
+        self.conn2 = self.container.create_connection("c2",
+                                                      self.conn2_handler,
+                                                      props)
+        self.conn1.open()
+        self.conn2.open()
+
+    def teardown(self):
+        self.conn1.destroy()
+        self.conn2.destroy()
+        self.container.destroy()
+        super(CallbackProfilerTest, self).teardown()
+
+    def test_profile_callbacks(self):
+        sender = self.conn1.create_sender("src", "tgt",
+                                          common.SenderCallback())
+        sender.open()
+        common.process_connections(self.conn1, self.conn2)
+        args = self.conn2_handler.receiver_requested_args[0]
+        r_handler = _SlowReceiver()
+        receiver = self.conn2.accept_receiver(args.link_handle,
+                                              event_handler=r_handler)
+        receiver.open()
+        receiver.add_capacity(2)
+        common.process_connections(self.conn1, self.conn2)
+        callbacks = [common.DeliveryCallback() for i in range(2)]
+        for cb in callbacks:
+            sender.send(Message(), cb)
+        common.process_connections(self.conn1, self.conn2)
+        assert len(r_handler.received_messages) == 2
+        for message, handle in r_handler.received_messages:
+            receiver.message_accepted(handle)
+        common.process_connections(self.conn1, self.conn2)
+        assert all(cb.count == 1 for cb in callbacks)
+
+        stats = self.profiler.stats()
+        assert stats["ConnCallback.receiver_requested"]["calls"] == 1
+        assert stats["SenderCallback.sender_active"]["calls"] == 1
+        assert stats["DeliveryCallback.__call__"]["calls"] == 2
+        received = stats["_SlowReceiver.message_received"]
+        assert received["calls"] == 2 and received["slow"] == 2
+        assert received["max"] >= 0.05
+        assert received["total"] >= 0.1
+        assert received["mean"] >= 0.05
+        assert stats["DeliveryCallback.__call__"]["slow"] == 0
+        assert self.profiler.slow == [
+            ("c2", "_SlowReceiver.message_received")] * 2
+        self.profiler.reset()
+        assert not self.profiler.stats()
+
+
+class _Monitor(pyngus.LoopMonitor):
+    def __init__(self, lag_threshold):
+        super(_Monitor, self).__init__(lag_threshold)
+        self.late = []
+
+    def timer_late(self, connection, lag):
+        self.late.append((connection.name, lag))
+
+
+class LoopMonitorTest(common.Test):
+
+    def setup(self):
+        super(LoopMonitorTest, self).setup()
+        self.monitor = _Monitor(0.25)
+        self.container = pyngus.Container("c")
+
+    def teardown(self):
+        self.container.destroy()
+        super(LoopMonitorTest, self).teardown()
+
+    def test_loop_phases(self):
+        props = {"x-loop-monitor": self.monitor,
+                 "idle-time-out": 10}
+        c1 = self.container.create_connection("c1", properties=props)
+        c2 = self.container.create_connection("c2", properties=props)
+        s1, s2 = socket.socketpair()
+        s1.setblocking(0)
+        s2.setblocking(0)
+        try:
+            c1.open()
+            c2.open()
+            now = time.time()
+            for i in range(3):
+                for conn in (c1, c2):
+                    conn.process(now)
+                pyngus.write_socket_output(c1, s1)
+                pyngus.write_socket_output(c2, s2)
+                pyngus.read_socket_input(c1, s1)
+                pyngus.read_socket_input(c2, s2)
+            assert c1.active and c2.active
+            stats = self.monitor.stats()
+            assert stats["read"].count == 6
+            assert stats["write"].count == 6
+            assert stats["process"].count == 6
+            assert stats["timer"].count == 0
+            assert stats["lag"].count == 0
+
+            # process after the idle timeout tick is due:
+            deadline = c1.deadline
+            assert deadline
+            c1.process(deadline + 0.5)
+            assert stats["timer"].count == 1
+            assert stats["lag"].count == 1
+            assert abs(stats["lag"].max - 0.5) < 0.001
+            assert len(self.monitor.late) == 1
+            assert self.monitor.late[0][0] == "c1"
+            # before the deadline:
+            c2.process(now)
+            assert stats["process"].count == 7
+            assert stats["timer"].count == 1
+
+            self.monitor.reset()
+            assert all(h.count == 0 for h in self.monitor.stats().values())
+        finally:
+            c1.destroy()
+            c2.destroy()
+            s1.close()
+            s2.close()